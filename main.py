@@ -1,25 +1,51 @@
 import os
+import sys
 import json
+import gzip
+import hmac
+import hashlib
+import argparse
+import itertools
 import re
 import time
 import math
 import asyncio
+import heapq
+import bisect
 import logging
+import signal
+import gc
+import tracemalloc
+import multiprocessing
+import random
+import tempfile
+import contextvars
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
 from uuid import uuid4
 
 from telegram import (
+    Bot,
     Update,
     ReplyKeyboardMarkup,
     InlineKeyboardMarkup,
     InlineKeyboardButton,
+    InputMediaPhoto,
+    InlineQueryResultArticle,
+    InlineQueryResultCachedPhoto,
+    InputTextMessageContent,
 )
 from telegram.constants import ChatMemberStatus
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+from telegram.request import BaseRequest, HTTPXRequest
 from telegram.ext import (
     Application,
     CommandHandler,
     MessageHandler,
     CallbackQueryHandler,
     ConversationHandler,
+    InlineQueryHandler,
     ContextTypes,
     filters,
 )
@@ -27,20 +53,118 @@ from telegram.ext import (
 BOT_TOKEN = os.getenv("BOT_TOKEN", "").strip()
 ADMIN_ID = int(os.getenv("ADMIN_ID", "0"))
 ARCHIVE_CHANNEL_ID = int(os.getenv("ARCHIVE_CHANNEL_ID", "0"))
+# More channels the admin may upload to, and mirror channels that receive
+# forwards of archive posts (used as fallbacks when a source fails).
+ARCHIVE_CHANNEL_IDS = [ARCHIVE_CHANNEL_ID] + [
+    int(x) for x in os.getenv("ARCHIVE_EXTRA_CHANNEL_IDS", "").split(",") if x.strip()
+]
+ARCHIVE_MIRROR_IDS = [int(x) for x in os.getenv("ARCHIVE_MIRROR_CHANNEL_IDS", "").split(",") if x.strip()]
 
 REQUIRED_CHANNEL_ID = int(os.getenv("REQUIRED_CHANNEL_ID", "0") or "0")
 REQUIRED_CHANNEL_USERNAME = os.getenv("REQUIRED_CHANNEL_USERNAME", "").strip()
 
+# Point at a local/fake Bot API server, e.g. http://127.0.0.1:8081/bot
+BOT_API_BASE_URL = os.getenv("BOT_API_BASE_URL", "").strip()
+WORKERS = max(1, int(os.getenv("WORKERS", "1")))
+
 DB_PATH = "db.json"
+# How often worker processes that don't write the catalog look for a new db.json.
+CATALOG_WATCH_INTERVAL = 1
 DELETE_TIME = 30
 PAGE_SIZE = 8
 
+POSTER_CHECK_INTERVAL = int(os.getenv("POSTER_CHECK_INTERVAL", "60"))
+POSTER_CHECK_BATCH = int(os.getenv("POSTER_CHECK_BATCH", "3"))
+POSTER_RECHECK_AGE = int(os.getenv("POSTER_RECHECK_AGE", "86400"))
+
+# Catalog audit: archive references checked per step, and a hard cap on the
+# Bot API calls the auditor may spend per minute. Probe copies land in
+# AUDIT_CHAT_ID, a dedicated chat, and are deleted right away; without it
+# only the structure of references is checked.
+AUDIT_INTERVAL = int(os.getenv("AUDIT_INTERVAL", "60"))
+AUDIT_BATCH = 100
+COPY_MESSAGES_LIMIT = 100
+AUDIT_CALLS_PER_MINUTE = int(os.getenv("AUDIT_CALLS_PER_MINUTE", "6"))
+AUDIT_CHAT_ID = int(os.getenv("AUDIT_CHAT_ID", "0") or "0")
+AUDIT_PATH = "audit.json"
+
+# Global Telegram send budget (messages/second), split across workers.
+OUTBOUND_RATE = float(os.getenv("OUTBOUND_RATE", "25"))
+OUTBOUND_SENDERS = int(os.getenv("OUTBOUND_SENDERS", "4"))
+HOT_DELIVERY_WINDOW = int(os.getenv("HOT_DELIVERY_WINDOW", "300"))
+HOT_DELIVERY_THRESHOLD = int(os.getenv("HOT_DELIVERY_THRESHOLD", "20"))
+
+IMPORT_BATCH = 500
+
+BROADCAST_POLL = 2
+BROADCAST_SAVE_EVERY = 20
+BROADCAST_MAX_AGE = 24 * 3600
+ANNOUNCEMENTS_KEEP = 50
+
+# Scheduled publishing: how often due items are released, and the UTC offset
+# (minutes) admins write times in; unset means the server's local time.
+PUBLISH_CHECK_INTERVAL = 15
+SCHEDULE_UTC_OFFSET = os.getenv("SCHEDULE_UTC_OFFSET", "").strip()
+SCHEDULE_LIST_LIMIT = 30
+
+# Overload controller: level 1 (degrade) past these, level 2 (shed) past twice these.
+OVERLOAD_LAG = float(os.getenv("OVERLOAD_LAG", "0.5"))
+OVERLOAD_QUEUE = int(os.getenv("OVERLOAD_QUEUE", "200"))
+OVERLOAD_DELETES = int(os.getenv("OVERLOAD_DELETES", "5000"))
+OVERLOAD_CHECK_INTERVAL = 1.0
+OVERLOAD_COOLDOWN = 10
+
+WATCH_FLUSH_INTERVAL = 30
+WATCH_KEEP = 50
+
+FUZZY_THRESHOLD = 0.3
+FUZZY_CANDIDATES = 30
+FUZZY_MIN_RATIO = 0.6
+FUZZY_SUGGESTIONS = 5
+
+INLINE_CACHE_TIME = 300
+INLINE_PAGE_SIZE = 20
+# Rendered responses (category pages, overviews, inline answers) kept per catalog version.
+RESPONSE_CACHE_SIZE = 1024
+
+# Upper bound for the shutdown drain (queued sends, persistence flushes).
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "20"))
+# Dropping the backlog on start loses whatever arrived during a deploy.
+DROP_PENDING_UPDATES = os.getenv("DROP_PENDING_UPDATES", "0") == "1"
+
+# Fraction of updates traced span by span; slower traces go to TRACE_LOG_PATH.
+TRACE_SAMPLE = float(os.getenv("TRACE_SAMPLE", "0.05"))
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "1000"))
+TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH", "traces.jsonl")
+
+# Memory diagnostics (/diag). DIAG_INTERVAL > 0 also appends a report to
+# DIAG_LOG_PATH every that many seconds; DIAG_TRACEMALLOC=N starts
+# tracemalloc at launch keeping N frames per allocation.
+DIAG_INTERVAL = int(os.getenv("DIAG_INTERVAL", "0"))
+DIAG_LOG_PATH = os.getenv("DIAG_LOG_PATH", "diag.jsonl")
+DIAG_TRACEMALLOC = int(os.getenv("DIAG_TRACEMALLOC", "0"))
+DIAG_TOP = 10
+DIAG_SAMPLE = 200
+
+# Optional log of incoming updates (gzip JSON lines) for `python main.py replay`.
+UPDATE_LOG_PATH = os.getenv("UPDATE_LOG_PATH", "").strip()
+UPDATE_LOG_FLUSH = 5
+UPDATE_LOG_BATCH = 500
+# Simulated Bot API round trip during replay.
+REPLAY_API_LATENCY_MS = float(os.getenv("REPLAY_API_LATENCY_MS", "40"))
+
+RECENT_LIMIT = 500
+RECENT_WINDOW = 7 * 24 * 3600
+ARCHIVE_FLUSH_DELAY = 3
+ARCHIVE_SOURCE_COOLDOWN = 300
+
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
     level=logging.INFO,
 )
 log = logging.getLogger("bot")
 
+# Seed for new catalogs; the live list is db["categories"] (see /cat).
 CATEGORIES = [
     "فیلم",
     "سریال",
@@ -71,33 +195,364 @@ HOME_BTN = "🏠 خانه"
     EDIT_WAIT_SEASON_SELECT,
     EDIT_WAIT_SERIES_EPISODE_COUNT,
     EDIT_WAIT_SERIES_EPISODE_FILE,
-) = range(14)
+    IMPORT_WAIT_FILE,
+    EDIT_BROWSE,
+) = range(16)
+
+# ================= TRACING =================
+
+# Every update gets a trace id and a total time; sampled ones also record
+# spans (catalog, membership, keyboards, outbound wait, each Bot API call).
+CURRENT_TRACE = contextvars.ContextVar("trace", default=None)
+
+trace_log = logging.getLogger("bot.trace")
+trace_log.propagate = False
+_trace_handler = logging.FileHandler(TRACE_LOG_PATH, encoding="utf-8", delay=True)
+_trace_handler.setFormatter(logging.Formatter("%(message)s"))
+trace_log.addHandler(_trace_handler)
+
+@contextmanager
+def span(name: str):
+    trace = CURRENT_TRACE.get()
+    if trace is None or trace["spans"] is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace["spans"].append((name, started - trace["started"], time.perf_counter() - started))
+
+def update_action(update: Update):
+    if update.callback_query:
+        return "callback", (update.callback_query.data or "").split(":", 1)[0]
+    if update.inline_query:
+        return "inline", ""
+    if update.message:
+        text = update.message.text or ""
+        if text.startswith("/"):
+            return "message", text.split()[0]
+        return "message", "text" if text else "media"
+    if update.channel_post:
+        return "channel_post", ""
+    return "other", ""
+
+def begin_trace():
+    return {
+        "id": uuid4().hex[:12],
+        "started": time.perf_counter(),
+        "spans": [] if random.random() < TRACE_SAMPLE else None,
+    }
+
+def finish_trace(trace: dict, update: Update):
+    total_ms = (time.perf_counter() - trace["started"]) * 1000
+    spans = trace["spans"]
+    # Tasks spawned by the handler may outlive it; they stop recording here.
+    trace["spans"] = None
+    if total_ms < TRACE_SLOW_MS:
+        return
+    kind, action = update_action(update)
+    user = update.effective_user
+    record = {
+        "trace": trace["id"],
+        "at": int(time.time()),
+        "worker": WORKER_INDEX,
+        "update_id": update.update_id,
+        "user": user.id if user else None,
+        "kind": kind,
+        "action": action,
+        "total_ms": round(total_ms, 1),
+        "sampled": spans is not None,
+    }
+    if spans is not None:
+        record["spans"] = [
+            {"name": name, "at_ms": round(at * 1000, 1), "ms": round(took * 1000, 1)}
+            for name, at, took in spans
+        ]
+    trace_log.info(json.dumps(record, ensure_ascii=False))
+
+class TracedApplication(Application):
+    async def process_update(self, update: object):
+        if not isinstance(update, Update):
+            return await super().process_update(update)
+        trace = begin_trace()
+        token = CURRENT_TRACE.set(trace)
+        try:
+            await super().process_update(update)
+        finally:
+            CURRENT_TRACE.reset(token)
+            finish_trace(trace, update)
+            if id(update) in REPLAY["enqueued"]:
+                REPLAY["latencies"].append(time.perf_counter() - REPLAY["enqueued"].pop(id(update)))
+
+class TracedRequest(BaseRequest):
+    # Wraps the real transport and times each Bot API method as a span.
+    def __init__(self, inner: BaseRequest):
+        self._inner = inner
+
+    @property
+    def read_timeout(self):
+        return self._inner.read_timeout
+
+    async def initialize(self):
+        await self._inner.initialize()
+
+    async def shutdown(self):
+        await self._inner.shutdown()
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        with span("api." + url.rsplit("/", 1)[-1]):
+            return await self._inner.do_request(url, method, request_data, **kwargs)
 
 # ================= DATABASE =================
 
 def default_db():
     return {
         "items": {},
-        "latest_item_id": None
+        "latest_item_id": None,
+        "archive_posts": {},
+        "archive_mirrors": {},
+        "announcements": [],
+        "announce_seq": 0,
+        "recent": [],
+        "handle_seq": 0,
+        "categories": seed_categories({}),
+        "category_renames": {},
+        "category_renames_seq": 0,
     }
 
-def load_db():
+# The parsed catalog is kept in memory and only re-read when db.json changes
+# on disk. The writer checks on load_db() (hand edits); other workers never
+# parse on a request: catalog_watch_loop() swaps the writer's new versions in.
+# "stamp" identifies the file version.
+#
+# A published catalog is never modified: readers keep whatever load_db()
+# returned for as long as they like. Changes go through change_catalog(),
+# which edits a private copy and publishes it in one step (nothing awaits in
+# between, so changes apply one at a time in order). A change that names the
+# items it touches gets a cheap copy sharing every other item and only those
+# items are reindexed; anything else is copied whole in a worker thread. The
+# file is written afterwards by a single saver task, always with the newest version;
+# mutate_catalog() also waits for that write.
+CATALOG = {"db": None, "stamp": None, "version": 0, "saved_version": 0, "saver": None}
+
+def db_file_stamp():
+    try:
+        st = os.stat(DB_PATH)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+def read_db_file():
     if not os.path.exists(DB_PATH):
         return default_db()
     try:
         with open(DB_PATH, "r", encoding="utf-8") as f:
             data = json.load(f)
-            if "items" not in data:
-                data["items"] = {}
-            if "latest_item_id" not in data:
-                data["latest_item_id"] = None
+            if "categories" not in data:
+                data["categories"] = seed_categories(data.get("items", {}))
+            for key, value in default_db().items():
+                if key not in data:
+                    data[key] = value
             return data
     except Exception:
         return default_db()
 
+def load_db():
+    with span("catalog"):
+        # While our own write is in flight the file is older than memory.
+        if CATALOG["db"] is not None and CATALOG["saver"] is not None:
+            return CATALOG["db"]
+        if CATALOG["db"] is not None and not is_catalog_writer():
+            return CATALOG["db"]
+        stamp = db_file_stamp()
+        if CATALOG["db"] is not None and CATALOG["stamp"] == stamp:
+            return CATALOG["db"]
+        db = read_db_file()
+        install_catalog(db, stamp, changed_item_ids(CATALOG["db"], db))
+        return db
+
+def changed_item_ids(old, db: dict):
+    # Items that differ between two versions read from disk; None means rebuild all.
+    if old is None or category_names(old) != category_names(db):
+        return None
+    changed = [item_id for item_id, item in db["items"].items() if old["items"].get(item_id) != item]
+    return changed + [item_id for item_id in old["items"] if item_id not in db["items"]]
+
+def install_catalog(db: dict, stamp, item_ids):
+    # Publishes a version read from disk; it is already saved.
+    publish_catalog(db, item_ids)
+    CATALOG["stamp"] = stamp
+    CATALOG["saved_version"] = CATALOG["version"]
+
+def read_catalog_update(old):
+    db = read_db_file()
+    return db, changed_item_ids(old, db)
+
+async def catalog_watch_loop():
+    # Parsing and diffing run in a thread; only changed items are reindexed here.
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(CATALOG_WATCH_INTERVAL)
+        stamp = db_file_stamp()
+        if stamp == CATALOG["stamp"]:
+            continue
+        try:
+            old = CATALOG["db"]
+            db, item_ids = await loop.run_in_executor(None, read_catalog_update, old)
+            install_catalog(db, stamp, item_ids if CATALOG["db"] is old else None)
+        except Exception:
+            log.exception("Catalog reload failed")
+
+# Maps that grow with the archive channels. Scoped copies share them, so a
+# change must replace them rather than edit them (see flush_archive_posts).
+SHARED_CATALOG_KEYS = ("archive_posts", "archive_mirrors")
+
+# Changes naming more items than this rebuild the indexes from scratch.
+REINDEX_LIMIT = 50
+
+def copy_json(value):
+    # Plain Python, unlike a json round trip, so a copy made in a worker
+    # thread still lets the event loop run in between.
+    if isinstance(value, dict):
+        return {k: copy_json(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [copy_json(v) for v in value]
+    return value
+
+def copy_catalog(db: dict, item_ids=None):
+    # item_ids=None copies everything. Otherwise only the named items are
+    # copied and every other item is shared with the published catalog.
+    if item_ids is None:
+        return copy_json(db)
+    copy = {
+        key: value if key in SHARED_CATALOG_KEYS else copy_json(value)
+        for key, value in db.items() if key != "items"
+    }
+    copy["items"] = dict(db["items"])
+    for item_id in item_ids:
+        if item_id in copy["items"]:
+            copy["items"][item_id] = copy_json(copy["items"][item_id])
+    return copy
+
+def publish_catalog(db: dict, item_ids=None):
+    # Indexes first: a catalog they cannot be built for is never published.
+    started = time.perf_counter()
+    CATALOG["version"] += 1
+    full = item_ids is None or len(item_ids) > REINDEX_LIMIT or CATALOG["db"] is None
+    try:
+        if full:
+            build_indexes(db)
+        else:
+            reindex_items(CATALOG["db"], db, item_ids)
+    except Exception:
+        if CATALOG["db"] is not None:
+            build_indexes(CATALOG["db"])
+        raise
+    CATALOG["db"] = db
+    if full:
+        # A one-off rebuild is not the bot falling behind; don't shed load for it.
+        OVERLOAD["excused"] += time.perf_counter() - started
+
+def apply_change(db: dict, change, item_ids):
+    result = change(db)
+    if result is False:
+        return result
+    publish_catalog(db, item_ids)
+    schedule_catalog_save()
+    return result
+
+def change_catalog(change, item_ids=None, copy_items=True):
+    # change(db) edits a private copy in place; its return value is passed back.
+    # Returning False leaves the catalog untouched. item_ids names every item
+    # the change edits, adds or removes; copy_items=False is for changes that
+    # only put new item dicts in their place.
+    if item_ids is not None:
+        item_ids = list(item_ids)
+    return apply_change(copy_catalog(load_db(), item_ids if copy_items else ()), change, item_ids)
+
+async def mutate_catalog(change, item_ids=None, copy_items=True):
+    if item_ids is None:
+        # A whole copy of a big catalog takes a while: make it in a thread and
+        # start over if another change was published in the meantime.
+        loop = asyncio.get_running_loop()
+        while True:
+            current = load_db()
+            version = CATALOG["version"]
+            db = await loop.run_in_executor(None, copy_catalog, current)
+            if CATALOG["version"] == version:
+                break
+        result = apply_change(db, change, None)
+    else:
+        result = change_catalog(change, item_ids, copy_items)
+    if CATALOG["saver"] is not None:
+        await asyncio.shield(CATALOG["saver"])
+    return result
+
+async def mutate_item(item_id: str, change):
+    # change(db, item) on the private copy; returns False if the item is gone.
+    def apply(db):
+        item = db["items"].get(item_id)
+        if not item:
+            return False
+        change(db, item)
+        return True
+    return await mutate_catalog(apply, [item_id])
+
+def schedule_catalog_save():
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        save_db(CATALOG["db"])
+        return
+    if CATALOG["saver"] is None:
+        CATALOG["saver"] = asyncio.create_task(catalog_saver())
+
+async def catalog_saver():
+    loop = asyncio.get_running_loop()
+    try:
+        while CATALOG["saved_version"] < CATALOG["version"]:
+            version, db = CATALOG["version"], CATALOG["db"]
+            await loop.run_in_executor(None, write_json_atomic, DB_PATH, db, 2)
+            CATALOG["stamp"] = db_file_stamp()
+            CATALOG["saved_version"] = version
+    finally:
+        CATALOG["saver"] = None
+
+async def flush_catalog():
+    if CATALOG["saved_version"] < CATALOG["version"]:
+        schedule_catalog_save()
+    while CATALOG["saver"] is not None:
+        await asyncio.shield(CATALOG["saver"])
+
+def write_json_atomic(path: str, data, indent=None):
+    # Write a new snapshot and swap it in, so readers (and other workers)
+    # never see a half-written file.
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=indent)
+    os.replace(tmp_path, path)
+
+def read_json(path: str, default):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+def state_path(name: str):
+    # Per-user state is owned by the worker its users are routed to.
+    if WORKER_INDEX is None:
+        return f"{name}.json"
+    return f"{name}.w{WORKER_INDEX}.json"
+
 def save_db(db):
-    with open(DB_PATH, "w", encoding="utf-8") as f:
-        json.dump(db, f, ensure_ascii=False, indent=2)
+    # Synchronous write and publish, for code running outside the event loop.
+    write_json_atomic(DB_PATH, db, indent=2)
+    if db is not CATALOG["db"]:
+        publish_catalog(db)
+    CATALOG["stamp"] = db_file_stamp()
+    CATALOG["saved_version"] = CATALOG["version"]
 
 def make_item_id(title: str):
     base = re.sub(r"[^\w\u0600-\u06FF]+", "_", title.strip()).strip("_")
@@ -105,6 +560,23 @@ def make_item_id(title: str):
         base = "item"
     return f"{base[:30]}_{uuid4().hex[:6]}"
 
+# What make_item_id() can produce: safe between ":" in callback_data.
+ITEM_ID_RE = re.compile(r"[\w\u0600-\u06FF]{1,37}")
+
+def to_base36(n: int):
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    out = ""
+    while True:
+        n, r = divmod(n, 36)
+        out = digits[r] + out
+        if not n:
+            return out
+
+def assign_handle(db: dict, item: dict):
+    # Short, stable, link-safe id (item ids can be long and non-ASCII).
+    db["handle_seq"] += 1
+    item["handle"] = to_base36(db["handle_seq"])
+
 def sort_numeric_keys(d: dict):
     return sorted(d.keys(), key=lambda x: int(x) if str(x).isdigit() else 999999)
 
@@ -115,19 +587,148 @@ def is_admin_update(update: Update):
     user = update.effective_user
     return bool(user and user.id == ADMIN_ID)
 
+# ================= RECENT FEED =================
+
+# db["recent"] is a bounded list of [item_id, timestamp], newest first. Every
+# operation on it is bounded by RECENT_LIMIT, never by the catalog size.
+
+def feed_remove(db: dict, item_id: str):
+    db["recent"] = [entry for entry in db["recent"] if entry[0] != item_id]
+
+def feed_push(db: dict, item_id: str, ts: int = None):
+    if ts is None:
+        ts = int(time.time())
+    feed_remove(db, item_id)
+    feed = db["recent"]
+    pos = 0
+    while pos < len(feed) and feed[pos][1] > ts:
+        pos += 1
+    if pos >= RECENT_LIMIT:
+        return
+    feed.insert(pos, [item_id, ts])
+    del feed[RECENT_LIMIT:]
+
+def sync_latest_item(db: dict):
+    feed = released_feed(db["recent"])
+    if feed:
+        db["latest_item_id"] = feed[0][0]
+        return
+    # Only reachable if every item in the feed was deleted.
+    db["latest_item_id"] = next((i for i in INDEX["recent"] if i in db["items"]), None)
+
+def feed_cutoff(feed: list, since: int):
+    # Index of the first entry older than `since` (the feed is newest first).
+    lo, hi = 0, len(feed)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if feed[mid][1] >= since:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+def released_feed(feed: list):
+    # Scheduled entries carry their publish time, so they wait at the head.
+    return feed[feed_cutoff(feed, int(SCHEDULE["clock"]) + 1):]
+
+# ================= CATEGORIES =================
+
+# Categories are an ordered list in the catalog, each with an item count that
+# is adjusted as items are added, deleted, imported or moved. Renamed and
+# merged names are remembered so old keyboards, links and subscriptions
+# still find their category.
+CATEGORY_NAME_MAX = 24
+
+def seed_categories(items: dict):
+    counts = Counter(item.get("category") for item in items.values())
+    names = list(CATEGORIES) + sorted(c for c in counts if c and c not in CATEGORIES)
+    return [{"name": name, "count": counts.get(name, 0)} for name in names]
+
+def category_names(db: dict):
+    return [c["name"] for c in db["categories"]]
+
+def category_key(name: str):
+    # Short, stable id for callback_data: survives reordering and fits in 64 bytes.
+    return hashlib.sha1(name.encode()).hexdigest()[:8]
+
+def find_category(db: dict, name: str):
+    for category in db["categories"]:
+        if category["name"] == name:
+            return category
+    return None
+
+def resolve_category(db: dict, name: str):
+    renames = db["category_renames"]
+    seen = set()
+    while name in renames and name not in seen:
+        seen.add(name)
+        name = renames[name]
+    return name
+
+def count_category(db: dict, name: str, delta: int):
+    category = find_category(db, name)
+    if category:
+        category["count"] = max(0, category["count"] + delta)
+
+def category_name_error(db: dict, name: str):
+    if not name:
+        return "اسم دسته‌بندی خالی است"
+    if len(name) > CATEGORY_NAME_MAX:
+        return f"اسم دسته‌بندی حداکثر {CATEGORY_NAME_MAX} حرف باشد"
+    # Names go into callback data split on ":" and share the menu with these buttons.
+    if ":" in name or "|" in name or name.startswith("/") or name in (SEARCH_BTN, BACK_BTN, HOME_BTN):
+        return "این اسم برای دسته‌بندی مجاز نیست"
+    if find_category(db, name):
+        return "این دسته‌بندی وجود دارد"
+    return None
+
+def move_items_to_category(db: dict, old: str, new: str):
+    # One pass over the catalog; the caller saves once and the indexes follow.
+    moved = 0
+    for item in db["items"].values():
+        if item.get("category") == old:
+            item["category"] = new
+            moved += 1
+    for ann in db["announcements"]:
+        if ann["category"] == old:
+            ann["category"] = new
+    for source, target in db["category_renames"].items():
+        if target == old:
+            db["category_renames"][source] = new
+    db["category_renames"][old] = new
+    db["category_renames"].pop(new, None)
+    # Bumped on every rename/merge, so readers notice even if the map kept its size.
+    db["category_renames_seq"] += 1
+    return moved
+
+def rename_category(db: dict, old: str, new: str):
+    category = find_category(db, old)
+    category["name"] = new
+    return move_items_to_category(db, old, new)
+
+def merge_category(db: dict, source: str, target: str):
+    moved = move_items_to_category(db, source, target)
+    count_category(db, target, find_category(db, source)["count"])
+    db["categories"].remove(find_category(db, source))
+    return moved
+
+def move_category(db: dict, name: str, position: int):
+    category = find_category(db, name)
+    db["categories"].remove(category)
+    position = max(1, min(position, len(db["categories"]) + 1))
+    db["categories"].insert(position - 1, category)
+    return position
+
 # ================= KEYBOARDS =================
 
 def kb_main():
-    return ReplyKeyboardMarkup(
-        [
-            ["فیلم", "سریال"],
-            ["کارتون", "انیمیشن"],
-            ["فیلم ایرانی", "سریال ایرانی"],
-            ["کالکشن ها", "بتمن ها"],
-            [SEARCH_BTN],
-        ],
-        resize_keyboard=True
-    )
+    return cached_keyboard("main")
+
+def build_kb_main():
+    names = list(INDEX["category_names"])
+    rows = [names[i:i + 2] for i in range(0, len(names), 2)]
+    rows.append([SEARCH_BTN])
+    return ReplyKeyboardMarkup(rows, resize_keyboard=True)
 
 def kb_cancel():
     return ReplyKeyboardMarkup(
@@ -143,7 +744,10 @@ def admin_kind_keyboard():
     )
 
 def admin_category_keyboard():
-    rows = [[c] for c in CATEGORIES]
+    return cached_keyboard("admin_category")
+
+def build_admin_category_keyboard():
+    rows = [[c] for c in INDEX["category_names"]]
     rows.append([BACK_BTN])
     rows.append(["/cancel"])
     return ReplyKeyboardMarkup(rows, resize_keyboard=True, one_time_keyboard=True)
@@ -153,13 +757,512 @@ def contact_admin_button():
         [InlineKeyboardButton("📞 تماس با ادمین", url=f"tg://user?id={ADMIN_ID}")]
     ])
 
+# ================= INDEXES =================
+
+# Everything here is derived from the catalog and rebuilt whenever it changes,
+# which keeps the read paths free of per-request sorting. Changes that name
+# their items (reindex_items) and scheduled releases update it in place instead.
+INDEX = {
+    "recent": [],
+    "by_category": {},
+    "search": [],
+    "keyboards": {},
+    "archive_ids": set(),
+    "rank": {},
+    "trigrams": {},
+    "trigram_sizes": {},
+    "fuzzy_titles": {},
+    "handles": {},
+    "category_names": (),
+    "category_keys": {},
+    "keyboard_categories": None,
+    "admin": {},
+    "all": [],
+    "schedule": [],
+}
+
+# Scheduled items and episodes carry a publish time and stay out of every
+# user-facing index until then. Visibility is judged against SCHEDULE["clock"],
+# which only the index build and release_due() move forward, so what a cached
+# response shows (its key carries "epoch") always agrees with the indexes.
+SCHEDULE = {"clock": 0, "epoch": 0}
+
+def is_released(item: dict):
+    return item.get("publish_at", 0) <= SCHEDULE["clock"]
+
+def episode_released(item: dict, season_num: str, episode_num: str):
+    publish_at = item.get("episode_publish_at", {}).get(season_num, {}).get(episode_num, 0)
+    return is_released(item) and publish_at <= SCHEDULE["clock"]
+
+def released_episodes(item: dict, season_num: str):
+    episodes = item.get("seasons", {}).get(season_num, {})
+    return [e for e in sort_numeric_keys(episodes) if episode_released(item, season_num, e)]
+
+def newest_first(items):
+    return sorted(items, key=lambda x: x.get("created_at", 0), reverse=True)
+
+def build_category_index(db: dict):
+    SCHEDULE["clock"] = time.time()
+    everything = [item["id"] for item in newest_first(db["items"].values())]
+    recent = [item_id for item_id in everything if is_released(db["items"][item_id])]
+    by_category = {}
+    for item_id in recent:
+        by_category.setdefault(db["items"][item_id].get("category"), []).append(item_id)
+    INDEX["all"] = everything
+    INDEX["recent"] = recent
+    INDEX["by_category"] = by_category
+    INDEX["category_names"] = tuple(category_names(db))
+    INDEX["category_keys"] = {category_key(name): name for name in INDEX["category_names"]}
+    if not db["recent"] and recent:
+        # Catalogs from before the feed existed: seed it once.
+        db["recent"] = [[item_id, db["items"][item_id].get("created_at", 0)] for item_id in recent[:RECENT_LIMIT]]
+
+def schedule_entries(item: dict):
+    if not is_released(item):
+        yield (item["publish_at"], item["id"], None, None)
+    for season_num, episodes in item.get("episode_publish_at", {}).items():
+        for episode_num, publish_at in episodes.items():
+            if publish_at > SCHEDULE["clock"]:
+                yield (publish_at, item["id"], season_num, episode_num)
+
+def build_schedule_index(db: dict):
+    # (publish_at, item_id, season, episode) still waiting, soonest first.
+    pending = [entry for item in db["items"].values() for entry in schedule_entries(item)]
+    pending.sort(key=lambda entry: entry[0])
+    INDEX["schedule"] = pending
+
+def build_search_index(db: dict):
+    INDEX["search"] = [
+        (
+            item_id,
+            normalize_text(db["items"][item_id].get("title", "")),
+            normalize_text(db["items"][item_id].get("category", "")),
+        )
+        for item_id in INDEX["recent"]
+    ]
+    INDEX["rank"] = {item_id: rank for rank, item_id in enumerate(INDEX["recent"])}
+    build_fuzzy_index()
+
+def index_position(ids: list, db: dict, created_at: int):
+    # Where an item created at `created_at` goes in a newest-first id list.
+    return bisect.bisect_right(ids, -created_at, key=lambda item_id: -db["items"][item_id].get("created_at", 0))
+
+def index_released_item(db: dict, item: dict):
+    # Adds one newly released item to the user-facing indexes in place,
+    # instead of rebuilding them for the whole catalog.
+    item_id, created_at = item["id"], item.get("created_at", 0)
+    pos = index_position(INDEX["recent"], db, created_at)
+    INDEX["recent"].insert(pos, item_id)
+    title = normalize_text(item.get("title", ""))
+    INDEX["search"].insert(pos, (item_id, title, normalize_text(item.get("category", ""))))
+    ids = INDEX["by_category"].setdefault(item.get("category"), [])
+    ids.insert(index_position(ids, db, created_at), item_id)
+    variants, grams = title_trigrams(title)
+    for gram in grams:
+        INDEX["trigrams"].setdefault(gram, []).append(item_id)
+    INDEX["trigram_sizes"][item_id] = len(grams)
+    INDEX["fuzzy_titles"][item_id] = variants
+
+def unindex_item(item: dict):
+    # Takes one item out of every per-item index, in place.
+    item_id = item["id"]
+    if item_id in INDEX["rank"]:
+        pos = INDEX["recent"].index(item_id)
+        del INDEX["recent"][pos]
+        del INDEX["search"][pos]
+    if item_id in INDEX["all"]:
+        INDEX["all"].remove(item_id)
+    ids = INDEX["by_category"].get(item.get("category"), [])
+    if item_id in ids:
+        ids.remove(item_id)
+        if not ids:
+            del INDEX["by_category"][item.get("category")]
+    for ids in INDEX["admin"].values():
+        if item_id in ids:
+            ids.remove(item_id)
+    variants = INDEX["fuzzy_titles"].pop(item_id, ())
+    for gram in set().union(*(trigrams(v) for v in variants)):
+        postings = INDEX["trigrams"].get(gram, [])
+        if item_id in postings:
+            postings.remove(item_id)
+            if not postings:
+                del INDEX["trigrams"][gram]
+    INDEX["trigram_sizes"].pop(item_id, None)
+    INDEX["schedule"] = [entry for entry in INDEX["schedule"] if entry[1] != item_id]
+    if INDEX["handles"].get(item.get("handle")) == item_id:
+        del INDEX["handles"][item["handle"]]
+
+def index_item(db: dict, item: dict):
+    # Adds one item to every per-item index, in place.
+    item_id, created_at = item["id"], item.get("created_at", 0)
+    INDEX["all"].insert(index_position(INDEX["all"], db, created_at), item_id)
+    if is_released(item):
+        index_released_item(db, item)
+    for name in admin_lists(item):
+        ids = INDEX["admin"][name]
+        ids.insert(index_position(ids, db, created_at), item_id)
+    entries = list(schedule_entries(item))
+    if entries:
+        INDEX["schedule"] = sorted(INDEX["schedule"] + entries, key=lambda entry: entry[0])
+    if not item.get("handle"):
+        assign_handle(db, item)
+    INDEX["handles"][item["handle"]] = item_id
+    # archive_ids only grows: a removed reference is still a real archive post.
+    INDEX["archive_ids"].update(filter(None, map(archive_ref, item_archive_message_ids(item))))
+
+def reindex_items(old_db: dict, db: dict, item_ids):
+    # Incremental build_indexes() for a change that named the items it touched.
+    for item_id in dict.fromkeys(item_ids):
+        if item_id in old_db["items"]:
+            unindex_item(old_db["items"][item_id])
+        if item_id in db["items"]:
+            index_item(db, db["items"][item_id])
+    INDEX["rank"] = {item_id: rank for rank, item_id in enumerate(INDEX["recent"])}
+    if db["archive_posts"] is not old_db["archive_posts"]:
+        added = db["archive_posts"].keys() - old_db["archive_posts"].keys()
+        INDEX["archive_ids"].update(parse_archive_post_key(key) for key in added)
+    build_keyboard_index(db)
+    repin_hot_items(db)
+
+def item_archive_message_ids(item: dict):
+    if item.get("kind") == "movie":
+        if item.get("archive_message_id"):
+            yield from file_variants(item["archive_message_id"])
+        return
+    for episodes in item.get("seasons", {}).values():
+        for value in episodes.values():
+            yield from file_variants(value)
+
+def build_archive_index(db: dict):
+    # Archive posts we have seen in the channels, plus references the catalog
+    # already uses (they predate the archive post log), as (chat_id, msg_id).
+    ids = {parse_archive_post_key(key) for key in db.get("archive_posts", {})}
+    for item in db["items"].values():
+        ids.update(filter(None, map(archive_ref, item_archive_message_ids(item))))
+    INDEX["archive_ids"] = ids
+
+def build_keyboard_index(db: dict):
+    # Menus only depend on the category list, so they survive other edits.
+    previous = INDEX["keyboards"]
+    if INDEX.get("keyboard_categories") != INDEX["category_names"] or "main" not in previous:
+        previous = {"main": build_kb_main(), "admin_category": build_admin_category_keyboard()}
+        INDEX["keyboard_categories"] = INDEX["category_names"]
+    INDEX["keyboards"] = {
+        "main": previous["main"],
+        "admin_category": previous["admin_category"],
+    }
+    # First pages are what nearly everyone opens; the rest are built on demand.
+    for category in INDEX["by_category"]:
+        category_page_response(db, category, 0)
+
+def build_handle_index(db: dict):
+    missing = [item for item in db["items"].values() if not item.get("handle")]
+    # Oldest first, so every worker backfills the same handles.
+    for item in sorted(missing, key=lambda x: x.get("created_at", 0)):
+        assign_handle(db, item)
+    INDEX["handles"] = {item["handle"]: item["id"] for item in db["items"].values()}
+
+def item_by_handle(db: dict, handle: str):
+    item_id = INDEX["handles"].get(handle)
+    item = db["items"].get(item_id) if item_id else None
+    return item if item and is_released(item) else None
+
+# /start payloads: i<handle>, i<handle>_<season>, i<handle>_<season>_<episode>.
+START_PAYLOAD_RE = re.compile(r"^i([0-9a-z]+)(?:_([0-9A-Za-z-]+)(?:_([0-9A-Za-z-]+))?)?$")
+
+def start_payload(item: dict, season_num: str = None, episode_num: str = None):
+    parts = [f"i{item['handle']}"]
+    for part in (season_num, episode_num):
+        if part is None or not re.fullmatch(r"[0-9A-Za-z-]+", str(part)):
+            break
+        parts.append(str(part))
+    return "_".join(parts)
+
+def parse_start_payload(payload: str):
+    match = START_PAYLOAD_RE.match(payload)
+    return match.groups() if match else None
+
+def admin_lists(item: dict):
+    # Names of the admin filter lists the item belongs in.
+    yield "movie" if item.get("kind") == "movie" else "series"
+    if not is_released(item):
+        yield "scheduled"
+    if not item.get("poster_file_id") or (item.get("poster_meta") or {}).get("ok") is False:
+        yield "no_poster"
+    if audit_references(item)[0]:
+        yield "no_files"
+
+def build_admin_index(db: dict):
+    # Newest-first id lists per admin filter, so a filtered page is a slice.
+    lists = {"movie": [], "series": [], "no_poster": [], "no_files": [], "scheduled": []}
+    for item_id in INDEX["all"]:
+        for name in admin_lists(db["items"][item_id]):
+            lists[name].append(item_id)
+    INDEX["admin"] = lists
+
+def build_indexes(db: dict):
+    build_handle_index(db)
+    build_category_index(db)
+    build_schedule_index(db)
+    build_admin_index(db)
+    build_search_index(db)
+    build_archive_index(db)
+    build_keyboard_index(db)
+    repin_hot_items(db)
+
+def cached_keyboard(name: str):
+    keyboard = INDEX["keyboards"].get(name)
+    if keyboard is None:
+        keyboard = build_kb_main() if name == "main" else build_admin_category_keyboard()
+        INDEX["keyboards"][name] = keyboard
+    return keyboard
+
+# Rendered responses keyed by (view, params, catalog version, release epoch).
+# Every catalog change bumps the version and every scheduled release the
+# epoch, so older entries are never hit again and just age out of the LRU;
+# nothing has to be cleared.
+RESPONSE_CACHE = OrderedDict()
+
+def cached_response(key: tuple):
+    response = RESPONSE_CACHE.get(key)
+    if response is not None:
+        RESPONSE_CACHE.move_to_end(key)
+    return response
+
+def cache_response(key: tuple, response):
+    RESPONSE_CACHE[key] = response
+    if len(RESPONSE_CACHE) > RESPONSE_CACHE_SIZE:
+        RESPONSE_CACHE.popitem(last=False)
+    return response
+
+def response_key(view: str, *params):
+    return (view, params, CATALOG["version"], SCHEDULE["epoch"])
+
+def category_page_response(db: dict, category: str, page: int):
+    key = response_key("category", category, page)
+    response = cached_response(key)
+    if response is not None:
+        return response
+
+    ids = INDEX["by_category"].get(category, [])
+    page_ids, page, pages = paginate_list(ids, page)
+    rows = []
+    for item_id in page_ids:
+        item = db["items"][item_id]
+        rows.append([
+            InlineKeyboardButton(item["title"], callback_data=f"item:{item['id']}:{category}:{page}")
+        ])
+
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("◀️ قبلی", callback_data=f"catpage:{category}:{page-1}"))
+    if page < pages - 1:
+        nav.append(InlineKeyboardButton("بعدی ▶️", callback_data=f"catpage:{category}:{page+1}"))
+    if nav:
+        rows.append(nav)
+
+    rows.append([InlineKeyboardButton("🔔 اطلاع‌رسانی این دسته", callback_data=f"sub_cat:{category}")])
+    rows.append([InlineKeyboardButton("🏠 خانه", callback_data="go_home")])
+
+    text = f"📂 {category}\nصفحه {page+1} از {pages}\nیکی را انتخاب کن:"
+    return cache_response(key, (text, InlineKeyboardMarkup(rows)))
+
+# ================= FUZZY SEARCH =================
+
+_PERSIAN_FOLD = str.maketrans({
+    "ي": "ی", "ى": "ی", "ئ": "ی",
+    "ك": "ک",
+    "ة": "ه", "ۀ": "ه",
+    "أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا",
+    "\u200c": " ",
+    "ـ": None,
+})
+_DIACRITICS = re.compile(r"[\u064B-\u065F\u0670]")
+
+_LATIN_DIGRAPHS = {"sh": "ش", "ch": "چ", "kh": "خ", "zh": "ژ", "gh": "ق", "ph": "ف", "th": "ت", "oo": "و", "ee": "ی"}
+_LATIN_LETTERS = {
+    "b": "ب", "p": "پ", "t": "ت", "j": "ج", "d": "د", "r": "ر", "z": "ز", "s": "س",
+    "f": "ف", "q": "ق", "k": "ک", "c": "ک", "g": "گ", "l": "ل", "m": "م", "n": "ن",
+    "v": "و", "w": "و", "h": "ه", "y": "ی", "i": "ی", "u": "و", "x": "کس",
+}
+
+def normalize_text(text: str):
+    text = _DIACRITICS.sub("", str(text).lower().translate(_PERSIAN_FOLD))
+    return " ".join(text.split())
+
+def transliterate(text: str):
+    # Rough Latin -> Persian spelling (short vowels dropped, as Persian writes
+    # them), so "batman" can find "بتمن" and the other way round.
+    if not re.search(r"[a-z]", text):
+        return None
+    words = []
+    for word in text.split():
+        out = []
+        i = 0
+        while i < len(word):
+            pair = word[i:i + 2]
+            if pair in _LATIN_DIGRAPHS:
+                out.append(_LATIN_DIGRAPHS[pair])
+                i += 2
+                continue
+            ch = word[i]
+            if ch in "aeo":
+                if i == 0:
+                    out.append("ا")
+            else:
+                out.append(_LATIN_LETTERS.get(ch, ch))
+            i += 1
+        words.append("".join(out))
+    return " ".join(words)
+
+def text_variants(text: str):
+    variants = [text]
+    translit = transliterate(text)
+    if translit and translit != text:
+        variants.append(translit)
+    return variants
+
+def trigrams(text: str):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def title_trigrams(title: str):
+    variants = text_variants(title)
+    return variants, set().union(*(trigrams(v) for v in variants))
+
+def build_fuzzy_index():
+    postings = {}
+    sizes = {}
+    titles = {}
+    for item_id, title, _ in INDEX["search"]:
+        variants, grams = title_trigrams(title)
+        for gram in grams:
+            postings.setdefault(gram, []).append(item_id)
+        sizes[item_id] = len(grams)
+        titles[item_id] = variants
+    INDEX["trigrams"] = postings
+    INDEX["trigram_sizes"] = sizes
+    INDEX["fuzzy_titles"] = titles
+
+def substring_search(query: str):
+    q = normalize_text(query)
+    if not q:
+        return []
+
+    if len(q) < 3:
+        return [item_id for item_id, title, category in INDEX["search"] if q in title or q in category]
+
+    # Any title containing q contains all of q's inner trigrams.
+    grams = {q[i:i + 3] for i in range(len(q) - 2)}
+    postings = sorted((INDEX["trigrams"].get(g, ()) for g in grams), key=len)
+    candidates = set(postings[0]).intersection(*postings[1:])
+    matches = {item_id for item_id in candidates if q in INDEX["fuzzy_titles"][item_id][0]}
+
+    for category, ids in INDEX["by_category"].items():
+        if category and q in normalize_text(category):
+            matches.update(ids)
+
+    return sorted(matches, key=INDEX["rank"].__getitem__)
+
+def edit_distance(a: str, b: str):
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, start=1):
+        current = [i]
+        for j, cb in enumerate(b, start=1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+def similarity_ratio(query: str, title: str):
+    def ratio(a, b):
+        return 1 - edit_distance(a, b) / max(len(a), len(b), 1)
+
+    best = ratio(query, title)
+    words = title.split()
+    width = len(query.split())
+    # Also compare against runs of words, so a short query can match part of a long title.
+    for size in (width, width + 1):
+        for start in range(0, max(0, len(words) - size) + 1):
+            best = max(best, ratio(query, " ".join(words[start:start + size])))
+    return best
+
+def fuzzy_search(query: str, limit: int = FUZZY_SUGGESTIONS):
+    variants = text_variants(normalize_text(query))
+
+    # Share of the query's trigrams found in each title, best spelling wins.
+    coverage = {}
+    for variant in variants:
+        grams = trigrams(variant)
+        shared = Counter()
+        for gram in grams:
+            for item_id in INDEX["trigrams"].get(gram, ()):
+                shared[item_id] += 1
+        for item_id, count in shared.items():
+            coverage[item_id] = max(coverage.get(item_id, 0), count / len(grams))
+
+    # Cheap trigram filter first; edit distance only runs on the best few.
+    candidates = heapq.nlargest(
+        FUZZY_CANDIDATES,
+        ((score, item_id) for item_id, score in coverage.items() if score >= FUZZY_THRESHOLD),
+    )
+
+    scored = []
+    for _, item_id in candidates:
+        best = max(
+            similarity_ratio(v, title)
+            for v in variants
+            for title in INDEX["fuzzy_titles"][item_id]
+        )
+        if best >= FUZZY_MIN_RATIO:
+            scored.append((best, -INDEX["rank"][item_id], item_id))
+
+    scored.sort(reverse=True)
+    return [item_id for _, _, item_id in scored[:limit]]
+
+# ================= STARTUP =================
+
+STARTUP = {"ready": False, "stages": []}
+BACKGROUND_TASKS = []
+
+def warm_up():
+    stages = []
+
+    def timed(name, fn):
+        started = time.perf_counter()
+        result = fn()
+        stages.append((name, (time.perf_counter() - started) * 1000))
+        return result
+
+    db = timed("catalog", read_db_file)
+    CATALOG["db"] = db
+    CATALOG["stamp"] = db_file_stamp()
+    timed("handles", lambda: build_handle_index(db))
+    timed("category index", lambda: build_category_index(db))
+    timed("schedule", lambda: build_schedule_index(db))
+    timed("admin index", lambda: build_admin_index(db))
+    timed("search index", lambda: build_search_index(db))
+    timed("archive index", lambda: build_archive_index(db))
+    timed("keyboards", lambda: build_keyboard_index(db))
+    repin_hot_items(db)
+
+    STARTUP["stages"] = stages
+    STARTUP["ready"] = True
+    log.info(
+        "Startup ready (%s items): %s",
+        len(db["items"]),
+        ", ".join(f"{name} {ms:.1f}ms" for name, ms in stages),
+    )
+
 # ================= MEMBERSHIP =================
 
 async def is_joined_required_channel(user_id: int, context: ContextTypes.DEFAULT_TYPE):
     if not REQUIRED_CHANNEL_ID:
         return True
     try:
-        member = await context.bot.get_chat_member(REQUIRED_CHANNEL_ID, user_id)
+        with span("membership"):
+            member = await context.bot.get_chat_member(REQUIRED_CHANNEL_ID, user_id)
         return member.status in {
             ChatMemberStatus.MEMBER,
             ChatMemberStatus.ADMINISTRATOR,
@@ -194,6 +1297,466 @@ async def ensure_joined(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.callback_query.message.reply_text(text, reply_markup=markup)
     return False
 
+# ================= OUTBOUND =================
+
+# Every message we send to users goes through one priority queue, paced to
+# the Telegram send budget. Lower numbers leave first.
+PRIORITY_HOT = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+OUTBOUND = {"queue": None, "next_slot": 0.0, "seq": 0, "senders": []}
+
+def to_seconds(value):
+    # PTB reports durations as int or timedelta depending on PTB_TIMEDELTA.
+    if hasattr(value, "total_seconds"):
+        return value.total_seconds()
+    return float(value)
+
+def retry_after_seconds(error: RetryAfter):
+    return to_seconds(error.retry_after)
+
+async def wait_outbound_slot():
+    loop = asyncio.get_running_loop()
+    now = loop.time()
+    slot = max(now, OUTBOUND["next_slot"])
+    OUTBOUND["next_slot"] = slot + WORKERS / OUTBOUND_RATE
+    if slot > now:
+        await asyncio.sleep(slot - now)
+
+async def outbound_sender(queue):
+    loop = asyncio.get_running_loop()
+    while True:
+        _, _, send, future = await queue.get()
+        try:
+            while not future.done():
+                await wait_outbound_slot()
+                try:
+                    result = await send()
+                except RetryAfter as e:
+                    # Flood control applies to the whole bot, so back off every lane.
+                    OUTBOUND["next_slot"] = max(OUTBOUND["next_slot"], loop.time() + retry_after_seconds(e))
+                    continue
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+                    break
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            queue.task_done()
+
+async def outbound_send(send, priority: int = PRIORITY_NORMAL):
+    queue = OUTBOUND["queue"]
+    if queue is None:
+        return await send()
+    trace = CURRENT_TRACE.get()
+    if trace is not None and trace["spans"] is not None:
+        # Senders run in their own tasks; carry the trace over so the API
+        # call is recorded against the update that queued it.
+        untraced = send
+
+        async def send():
+            token = CURRENT_TRACE.set(trace)
+            try:
+                return await untraced()
+            finally:
+                CURRENT_TRACE.reset(token)
+
+    future = asyncio.get_running_loop().create_future()
+    OUTBOUND["seq"] += 1
+    queue.put_nowait((priority, OUTBOUND["seq"], send, future))
+    with span("outbound"):
+        return await future
+
+def start_outbound():
+    queue = asyncio.PriorityQueue()
+    OUTBOUND["queue"] = queue
+    OUTBOUND["senders"] = [asyncio.create_task(outbound_sender(queue)) for _ in range(OUTBOUND_SENDERS)]
+    BACKGROUND_TASKS.extend(OUTBOUND["senders"])
+
+async def drain_outbound(timeout: float):
+    # Let the senders finish what is already queued; returns how many were left.
+    queue = OUTBOUND["queue"]
+    if queue is None:
+        return 0
+    try:
+        await asyncio.wait_for(queue.join(), timeout=max(timeout, 0))
+    except asyncio.TimeoutError:
+        pass
+    return queue.qsize()
+
+def stop_outbound():
+    queue = OUTBOUND["queue"]
+    OUTBOUND["queue"] = None
+    OUTBOUND["senders"] = []
+    if queue is None:
+        return
+    while not queue.empty():
+        _, _, _, future = queue.get_nowait()
+        future.cancel()
+
+# ================= OVERLOAD =================
+
+# Level 0 is normal. At 1, search drops fuzzy matching and low-priority
+# work (announcements, poster checks, audits) waits. At 2, file deliveries
+# are answered with "busy, retry in N s". The admin is never shed and their
+# updates skip ahead of the user backlog.
+# "excused" is loop time spent on one-off work (full index rebuilds) that the
+# next lag sample leaves out.
+OVERLOAD = {"level": 0, "lag": 0.0, "queue": 0, "deletes": 0, "calm_since": 0.0, "excused": 0.0}
+
+class UpdateQueue(asyncio.Queue):
+    # Admin updates go to the front (in arrival order among themselves), so a
+    # user backlog never delays the admin's commands.
+    def _init(self, maxsize):
+        super()._init(maxsize)
+        self._admin_ahead = 0
+
+    def _put(self, item):
+        if WORKER_INDEX is None and isinstance(item, Update):
+            record_update(item)
+        user = item.effective_user if isinstance(item, Update) else None
+        if user and user.id == ADMIN_ID:
+            self._queue.insert(self._admin_ahead, item)
+            self._admin_ahead += 1
+        else:
+            self._queue.append(item)
+
+    def _get(self):
+        if self._admin_ahead:
+            self._admin_ahead -= 1
+        return self._queue.popleft()
+
+def overload_pressure(lag: float, queue: int, deletes: int):
+    ratio = max(lag / OVERLOAD_LAG, queue / OVERLOAD_QUEUE, deletes / OVERLOAD_DELETES)
+    if ratio >= 2:
+        return 2
+    if ratio >= 1:
+        return 1
+    return 0
+
+async def overload_monitor():
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(OVERLOAD_CHECK_INTERVAL)
+        OVERLOAD["lag"] = max(0.0, loop.time() - started - OVERLOAD_CHECK_INTERVAL - OVERLOAD["excused"])
+        OVERLOAD["excused"] = 0.0
+        OVERLOAD["queue"] = OUTBOUND["queue"].qsize() if OUTBOUND["queue"] else 0
+        OVERLOAD["deletes"] = len(PENDING_DELETES)
+        level = overload_pressure(OVERLOAD["lag"], OVERLOAD["queue"], OVERLOAD["deletes"])
+
+        now = time.time()
+        if level >= OVERLOAD["level"]:
+            OVERLOAD["calm_since"] = now
+        elif now - OVERLOAD["calm_since"] < OVERLOAD_COOLDOWN:
+            # Step down only after staying calm for a while, to avoid flapping.
+            continue
+        if level != OVERLOAD["level"]:
+            log.warning(
+                "Overload level %s -> %s (lag %.2fs, queue %s, pending deletes %s)",
+                OVERLOAD["level"], level, OVERLOAD["lag"], OVERLOAD["queue"], OVERLOAD["deletes"],
+            )
+            OVERLOAD["level"] = level
+
+def is_overloaded(level: int = 1):
+    return OVERLOAD["level"] >= level
+
+def busy_retry_seconds():
+    backlog = OVERLOAD["queue"] * WORKERS / OUTBOUND_RATE
+    return int(max(5, min(120, math.ceil(backlog + OVERLOAD["lag"]))))
+
+# ================= HOT DELIVERIES =================
+
+# Deliveries per item over the current and previous window; an item is hot
+# while the two together stay above HOT_DELIVERY_THRESHOLD. This is the one
+# hot-title list: it also orders poster checks and lets overviews be edited
+# in place.
+DELIVERIES = {"window_start": 0.0, "current": Counter(), "previous": Counter()}
+HOT_DELIVERIES = set()
+PINNED = {"files": {}, "overviews": {}}
+
+def delivery_count(item_id: str):
+    return DELIVERIES["current"][item_id] + DELIVERIES["previous"][item_id]
+
+def rotate_delivery_window():
+    now = time.monotonic()
+    elapsed = now - DELIVERIES["window_start"]
+    if elapsed < HOT_DELIVERY_WINDOW:
+        return
+    DELIVERIES["previous"] = DELIVERIES["current"] if elapsed < 2 * HOT_DELIVERY_WINDOW else Counter()
+    DELIVERIES["current"] = Counter()
+    DELIVERIES["window_start"] = now
+    for item_id in list(HOT_DELIVERIES):
+        if delivery_count(item_id) < HOT_DELIVERY_THRESHOLD:
+            HOT_DELIVERIES.discard(item_id)
+            unpin_item(item_id)
+
+def record_delivery(item_id: str):
+    rotate_delivery_window()
+    DELIVERIES["current"][item_id] += 1
+    if item_id in HOT_DELIVERIES or delivery_count(item_id) < HOT_DELIVERY_THRESHOLD:
+        return
+    HOT_DELIVERIES.add(item_id)
+    item = load_db()["items"].get(item_id)
+    if item:
+        pin_item(item)
+    log.info("Hot title: %s (%s deliveries)", item_id, delivery_count(item_id))
+
+def delivery_priority(item_id: str, chat_id: int = None):
+    if item_id in HOT_DELIVERIES or chat_id == ADMIN_ID:
+        return PRIORITY_HOT
+    return PRIORITY_NORMAL
+
+def pin_item(item: dict):
+    item_id = item["id"]
+    if item.get("kind") == "movie":
+        if item.get("archive_message_id"):
+            PINNED["files"][(item_id, None, None)] = item["archive_message_id"]
+    else:
+        for season_num, episodes in item.get("seasons", {}).items():
+            for ep_num, msg_id in episodes.items():
+                PINNED["files"][(item_id, season_num, ep_num)] = msg_id
+    PINNED["overviews"][(item_id, 0)] = build_overview(item, 0)
+
+def unpin_item(item_id: str):
+    for key in [k for k in PINNED["files"] if k[0] == item_id]:
+        del PINNED["files"][key]
+    for key in [k for k in PINNED["overviews"] if k[0] == item_id]:
+        del PINNED["overviews"][key]
+
+def repin_hot_items(db: dict):
+    # Catalog changed: pinned values may be stale, so resolve them again.
+    PINNED["files"].clear()
+    PINNED["overviews"].clear()
+    for item_id in list(HOT_DELIVERIES):
+        item = db["items"].get(item_id)
+        if item:
+            pin_item(item)
+        else:
+            HOT_DELIVERIES.discard(item_id)
+
+def resolve_archive_message_id(item: dict, season_num: str = None, episode_num: str = None):
+    if not (is_released(item) if season_num is None else episode_released(item, season_num, episode_num)):
+        return None
+    msg_id = PINNED["files"].get((item["id"], season_num, episode_num))
+    if msg_id is not None:
+        return msg_id
+    if season_num is None:
+        return item.get("archive_message_id")
+    return item.get("seasons", {}).get(season_num, {}).get(episode_num)
+
+# ================= ARCHIVES =================
+
+# A file reference is a message id in the main archive channel, or
+# {"c": chat_id, "m": message_id} for a post in one of the extra channels.
+# The dict form may also carry what ingestion learned about the file: "q"
+# quality, "s" size in bytes, "d" duration in seconds ("c" is left out for
+# the main channel). A movie or episode holds one reference, or a list of
+# them when the same file comes in several variants.
+ARCHIVE_SOURCES = {"down_until": {}, "load": Counter(), "gone": {}}
+QUALITY_RE = re.compile(r"(?<![0-9])([0-9]{3,4})[pP](?![a-zA-Z])")
+
+def file_variants(value):
+    return value if isinstance(value, list) else [value]
+
+def archive_ref(value):
+    if isinstance(value, dict):
+        chat_id, msg_id = value.get("c", ARCHIVE_CHANNEL_ID), value.get("m")
+    else:
+        chat_id, msg_id = ARCHIVE_CHANNEL_ID, value
+    if not isinstance(chat_id, int) or not isinstance(msg_id, int) or isinstance(msg_id, bool) or msg_id <= 0:
+        return None
+    return chat_id, msg_id
+
+def make_archive_ref(chat_id: int, msg_id: int, meta: dict = None):
+    ref = {"m": msg_id}
+    if chat_id != ARCHIVE_CHANNEL_ID:
+        ref["c"] = chat_id
+    ref.update((key, value) for key, value in (meta or {}).items() if value)
+    return msg_id if len(ref) == 1 else ref
+
+def media_meta(msg):
+    media = msg.video or msg.document
+    if media is None:
+        return {}
+    match = QUALITY_RE.search(f"{getattr(media, 'file_name', None) or ''} {msg.caption or ''}")
+    quality = f"{match.group(1)}p" if match else None
+    if quality is None and msg.video and msg.video.height:
+        quality = f"{msg.video.height}p"
+    meta = {"q": quality, "s": media.file_size}
+    if msg.video and msg.video.duration is not None:
+        meta["d"] = int(to_seconds(msg.video.duration))
+    return meta
+
+def variant_meta(value):
+    # Recorded on the reference, else whatever the archive post log saw.
+    source = archive_ref(value)
+    post = load_db().get("archive_posts", {}).get(archive_post_key(*source), {}) if source else {}
+    meta = {"q": post.get("quality"), "s": post.get("size"), "d": post.get("duration")}
+    if isinstance(value, dict):
+        meta.update((key, value[key]) for key in ("q", "s", "d") if value.get(key))
+    return meta
+
+def format_size(size: int):
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.2f} GB"
+
+def variant_label(value, index: int):
+    meta = variant_meta(value)
+    parts = [meta["q"] or f"نسخه {index + 1}"]
+    if meta["s"]:
+        parts.append(format_size(meta["s"]))
+    if meta["d"]:
+        parts.append(f"{max(1, meta['d'] // 60)} دقیقه")
+    return " · ".join(parts)
+
+def valid_file_value(value):
+    variants = file_variants(value)
+    return bool(variants) and all(archive_ref(v) is not None for v in variants)
+
+def pick_variant(variants: list, quality: str = None):
+    # Index to deliver without asking, or None when the user should choose.
+    if len(variants) == 1:
+        return 0
+    if quality:
+        for index, value in enumerate(variants):
+            if variant_meta(value)["q"] == quality:
+                return index
+    return None
+
+def archive_post_key(chat_id: int, msg_id: int):
+    if chat_id == ARCHIVE_CHANNEL_ID:
+        return str(msg_id)
+    return f"{chat_id}:{msg_id}"
+
+def parse_archive_post_key(key: str):
+    if ":" in key:
+        chat_id, msg_id = key.split(":", 1)
+        return int(chat_id), int(msg_id)
+    return ARCHIVE_CHANNEL_ID, int(key)
+
+def archive_sources(ref):
+    # The recorded source plus its mirrors: healthy ones first, then the
+    # least busy, and the recorded source wins ties.
+    source = archive_ref(ref)
+    if source is None:
+        return []
+    mirrors = load_db()["archive_mirrors"].get(archive_post_key(*source), [])
+    candidates = [source] + [tuple(m) for m in mirrors]
+    now = time.time()
+    down = ARCHIVE_SOURCES["down_until"]
+    gone = ARCHIVE_SOURCES["gone"]
+    load = ARCHIVE_SOURCES["load"]
+    return sorted(
+        candidates,
+        key=lambda c: (down.get(c[0], 0) > now or gone.get(c, 0) > now, load[c[0]], candidates.index(c)),
+    )
+
+def mark_source_down(chat_id: int, error: Exception):
+    log.warning("Archive source %s unavailable: %s", chat_id, error)
+    ARCHIVE_SOURCES["down_until"][chat_id] = time.time() + ARCHIVE_SOURCE_COOLDOWN
+
+# copyMessage errors that can only be about the recipient, never the source.
+RECIPIENT_ERRORS = ("blocked", "deactivated", "user not found", "can't initiate", "bots can't send")
+
+async def source_reachable(bot, source_chat: int):
+    # "chat not found" and most Forbidden errors name neither side, so ask.
+    try:
+        await bot.get_chat(source_chat)
+    except TelegramError:
+        return False
+    return True
+
+async def copy_from_archive(bot, chat_id: int, ref, priority: int):
+    # Returns the sent MessageId, or None when no source still has the file.
+    for source_chat, source_msg in archive_sources(ref):
+        ARCHIVE_SOURCES["load"][source_chat] += 1
+        try:
+            return await outbound_send(
+                lambda: bot.copy_message(chat_id=chat_id, from_chat_id=source_chat, message_id=source_msg),
+                priority=priority,
+            )
+        except (Forbidden, BadRequest) as e:
+            text = str(e).lower()
+            if any(marker in text for marker in RECIPIENT_ERRORS):
+                raise
+            if isinstance(e, Forbidden) or "chat not found" in text or "channel_private" in text:
+                if await source_reachable(bot, source_chat):
+                    raise
+                mark_source_down(source_chat, e)
+            elif "not found" in text:
+                # The message itself is gone from this source; try the next one.
+                ARCHIVE_SOURCES["gone"][(source_chat, source_msg)] = time.time() + ARCHIVE_SOURCE_COOLDOWN
+            else:
+                raise
+        finally:
+            ARCHIVE_SOURCES["load"][source_chat] -= 1
+    return None
+
+# ================= WATCH HISTORY =================
+
+# Last delivered episode per user and series: {user_id: {item_id: [season, episode]}},
+# most recent last. Kept in memory and written to the worker's file in batches.
+WATCH = {"data": None, "dirty": False}
+
+def load_watch_history():
+    if WATCH["data"] is None:
+        WATCH["data"] = read_json(state_path("watch"), {})
+    return WATCH["data"]
+
+def save_watch_history():
+    if not WATCH["dirty"]:
+        return
+    WATCH["dirty"] = False
+    write_json_atomic(state_path("watch"), WATCH["data"])
+
+def record_watch(user_id: int, item_id: str, season_num: str, episode_num: str):
+    history = load_watch_history().setdefault(str(user_id), {})
+    history.pop(item_id, None)
+    history[item_id] = [season_num, episode_num]
+    while len(history) > WATCH_KEEP:
+        del history[next(iter(history))]
+    WATCH["dirty"] = True
+
+def last_watched(user_id: int, item_id: str):
+    entry = load_watch_history().get(str(user_id), {}).get(item_id)
+    return tuple(entry) if entry else None
+
+def next_episode(item: dict, season_num: str, episode_num: str):
+    seasons = item.get("seasons", {})
+    episodes = released_episodes(item, season_num)
+    if episode_num in episodes and episodes.index(episode_num) + 1 < len(episodes):
+        return season_num, episodes[episodes.index(episode_num) + 1]
+    season_keys = sort_numeric_keys(seasons)
+    if season_num in season_keys:
+        for later in season_keys[season_keys.index(season_num) + 1:]:
+            later_episodes = released_episodes(item, later)
+            if later_episodes:
+                return later, later_episodes[0]
+    return None
+
+def next_episode_button(item: dict, season_num: str, episode_num: str):
+    following = next_episode(item, season_num, episode_num)
+    if following is None:
+        return None
+    return InlineKeyboardButton(
+        f"▶️ قسمت بعد (فصل {following[0]} قسمت {following[1]})",
+        callback_data=f"episode:{item['id']}:{following[0]}:{following[1]}"
+    )
+
+async def watch_flush_loop():
+    while True:
+        await asyncio.sleep(WATCH_FLUSH_INTERVAL)
+        try:
+            save_watch_history()
+        except Exception as e:
+            log.exception(e)
+
 # ================= HELPERS =================
 
 def paginate_list(items, page, page_size=PAGE_SIZE):
@@ -205,55 +1768,99 @@ def paginate_list(items, page, page_size=PAGE_SIZE):
     return items[start:end], page, pages
 
 def get_archive_message_id_from_message(message):
-    if message.text and message.text.strip().isdigit():
-        return int(message.text.strip())
+    # Returns a file reference (see archive_ref); plain numbers mean the main channel.
+    # Several numbers separated by commas are variants of the same file.
+    if message.text:
+        parts = [p for p in re.split(r"[\s,،]+", message.text.strip()) if p]
+        if len(parts) == 1 and parts[0].isdigit():
+            return int(parts[0])
+        if parts and all(p.isdigit() and int(p) > 0 for p in parts):
+            return [int(p) for p in parts]
 
     try:
         if getattr(message, "forward_from_chat", None) and getattr(message, "forward_from_message_id", None):
-            if message.forward_from_chat.id == ARCHIVE_CHANNEL_ID:
-                return int(message.forward_from_message_id)
+            if message.forward_from_chat.id in ARCHIVE_CHANNEL_IDS:
+                return make_archive_ref(message.forward_from_chat.id, int(message.forward_from_message_id), media_meta(message))
     except Exception:
         pass
 
     try:
         origin = getattr(message, "forward_origin", None)
         if origin and hasattr(origin, "chat") and hasattr(origin, "message_id"):
-            if origin.chat.id == ARCHIVE_CHANNEL_ID:
-                return int(origin.message_id)
+            if origin.chat.id in ARCHIVE_CHANNEL_IDS:
+                return make_archive_ref(origin.chat.id, int(origin.message_id), media_meta(message))
     except Exception:
         pass
 
     return None
 
-async def auto_delete_file_and_keep_redownload(
-    context: ContextTypes.DEFAULT_TYPE,
-    chat_id: int,
-    sent_message_id: int,
-    item_id: str,
-    season_num: str = None,
-    episode_num: str = None,
-):
-    await asyncio.sleep(DELETE_TIME)
+# Deliveries waiting for auto-delete, keyed by (chat_id, message_id). Whatever is
+# still here at shutdown is written to disk and rescheduled on the next start.
+PENDING_DELETES = {}
+DELETE_TASKS = {}
+
+def schedule_delete(bot, chat_id: int, message_id: int, item_id: str,
+                    season_num: str = None, episode_num: str = None, due: float = None):
+    key = (chat_id, message_id)
+    PENDING_DELETES[key] = {
+        "chat_id": chat_id,
+        "message_id": message_id,
+        "item_id": item_id,
+        "season": season_num,
+        "episode": episode_num,
+        "due": due if due is not None else time.time() + DELETE_TIME,
+    }
+    DELETE_TASKS[key] = asyncio.create_task(auto_delete_file_and_keep_redownload(bot, key))
+
+def save_pending_deletes():
+    for task in DELETE_TASKS.values():
+        task.cancel()
+    DELETE_TASKS.clear()
+    records = list(PENDING_DELETES.values())
+    PENDING_DELETES.clear()
+    write_json_atomic(state_path("deletes"), records)
+    return len(records)
+
+def resume_pending_deletes(bot):
+    records = read_json(state_path("deletes"), [])
+    for r in records:
+        schedule_delete(bot, r["chat_id"], r["message_id"], r["item_id"], r["season"], r["episode"], r["due"])
+    if records:
+        write_json_atomic(state_path("deletes"), [])
+        log.info("Resumed %s pending deletes", len(records))
+
+async def auto_delete_file_and_keep_redownload(bot, key: tuple):
+    record = PENDING_DELETES[key]
+    chat_id = record["chat_id"]
+    item_id = record["item_id"]
+    season_num = record["season"]
+    episode_num = record["episode"]
+    await asyncio.sleep(max(0, record["due"] - time.time()))
 
     try:
-        await context.bot.delete_message(chat_id=chat_id, message_id=sent_message_id)
+        await bot.delete_message(chat_id=chat_id, message_id=record["message_id"])
     except Exception:
         pass
 
     try:
         if season_num and episode_num:
-            keyboard = InlineKeyboardMarkup([
+            rows = [
                 [InlineKeyboardButton(
                     "🔁 دانلود مجدد",
                     callback_data=f"redownload_episode:{item_id}:{season_num}:{episode_num}"
                 )],
                 [InlineKeyboardButton("🏠 خانه", callback_data="go_home")]
-            ])
-            await context.bot.send_message(
+            ]
+            item = load_db()["items"].get(item_id)
+            following = next_episode_button(item, season_num, episode_num) if item else None
+            if following:
+                rows.insert(0, [following])
+            keyboard = InlineKeyboardMarkup(rows)
+            await outbound_send(lambda: bot.send_message(
                 chat_id=chat_id,
                 text="⏱ فایل حذف شد. برای دریافت دوباره روی دکمه زیر بزن.",
                 reply_markup=keyboard
-            )
+            ))
         else:
             keyboard = InlineKeyboardMarkup([
                 [InlineKeyboardButton(
@@ -262,47 +1869,166 @@ async def auto_delete_file_and_keep_redownload(
                 )],
                 [InlineKeyboardButton("🏠 خانه", callback_data="go_home")]
             ])
-            await context.bot.send_message(
+            await outbound_send(lambda: bot.send_message(
                 chat_id=chat_id,
                 text="⏱ فایل حذف شد. برای دریافت دوباره روی دکمه زیر بزن.",
                 reply_markup=keyboard
-            )
+            ))
     except Exception:
         pass
 
+    # Only a finished delete leaves the durable set; a cancelled one is handed off.
+    PENDING_DELETES.pop(key, None)
+    DELETE_TASKS.pop(key, None)
+
 async def copy_archive_message_and_schedule_delete(
     chat_id: int,
-    archive_message_id: int,
+    archive_message_id,
     item_id: str,
     context: ContextTypes.DEFAULT_TYPE,
     season_num: str = None,
     episode_num: str = None,
+    variant: int = None,
 ):
-    sent = await context.bot.copy_message(
-        chat_id=chat_id,
-        from_chat_id=ARCHIVE_CHANNEL_ID,
-        message_id=archive_message_id,
-    )
-
-    asyncio.create_task(
-        auto_delete_file_and_keep_redownload(
-            context=context,
+    if is_overloaded(2) and chat_id != ADMIN_ID:
+        await context.bot.send_message(
             chat_id=chat_id,
-            sent_message_id=sent.message_id,
-            item_id=item_id,
-            season_num=season_num,
-            episode_num=episode_num,
+            text=f"⏳ ربات الان خیلی شلوغ است. {busy_retry_seconds()} ثانیه دیگر دوباره امتحان کن.",
         )
-    )
+        return
+
+    # Several variants: use the quality this user picked for the title, else ask.
+    variants = file_variants(archive_message_id)
+    if variant is None or not 0 <= variant < len(variants):
+        variant = pick_variant(variants, context.user_data.get("quality", {}).get(item_id))
+    if variant is None:
+        rows = [
+            [InlineKeyboardButton(
+                f"📥 {variant_label(value, index)}",
+                callback_data=f"variant:{item_id}:{season_num or '-'}:{episode_num or '-'}:{index}"
+            )]
+            for index, value in enumerate(variants)
+        ]
+        await context.bot.send_message(chat_id=chat_id, text="کیفیت موردنظر را انتخاب کن:", reply_markup=InlineKeyboardMarkup(rows))
+        return
+    archive_message_id = variants[variant]
+
+    record_delivery(item_id)
+    sent = await copy_from_archive(context.bot, chat_id, archive_message_id, delivery_priority(item_id, chat_id))
+    if sent is None:
+        note_broken_reference(item_id, season_num, episode_num, archive_message_id)
+        await context.bot.send_message(chat_id=chat_id, text="❌ این فایل در دسترس نیست. لطفاً به ادمین اطلاع بده.")
+        return
+
+    if season_num and episode_num:
+        record_watch(chat_id, item_id, season_num, episode_num)
+    schedule_delete(context.bot, chat_id, sent.message_id, item_id, season_num, episode_num)
+
+# ================= POSTERS =================
+
+BROKEN_POSTERS = set()
+
+def poster_meta_from_photo(photo):
+    return {
+        "unique_id": photo.file_unique_id,
+        "width": photo.width,
+        "height": photo.height,
+        "checked_at": int(time.time()),
+        "ok": True,
+    }
+
+def poster_usable(item: dict):
+    if not item.get("poster_file_id"):
+        return False
+    if item["poster_file_id"] in BROKEN_POSTERS:
+        return False
+    return (item.get("poster_meta") or {}).get("ok", True)
+
+def mark_poster_broken(item_id: str, file_id: str):
+    BROKEN_POSTERS.add(file_id)
+    if not is_catalog_writer():
+        return
+
+    def change(db):
+        item = db["items"].get(item_id)
+        if not item or item.get("poster_file_id") != file_id:
+            return False
+        meta = item.get("poster_meta") or {}
+        meta["ok"] = False
+        meta["checked_at"] = int(time.time())
+        item["poster_meta"] = meta
+
+    change_catalog(change, [item_id])
+
+def posters_due_for_check(db: dict, now: int):
+    due = []
+    for item in db["items"].values():
+        if not item.get("poster_file_id"):
+            continue
+        meta = item.get("poster_meta") or {}
+        if now - meta.get("checked_at", 0) < POSTER_RECHECK_AGE:
+            continue
+        due.append(item)
+    # Hot titles first, then the posters that have waited longest.
+    due.sort(key=lambda x: (x["id"] not in HOT_DELIVERIES, (x.get("poster_meta") or {}).get("checked_at", 0)))
+    return due[:POSTER_CHECK_BATCH]
+
+async def check_posters_once(bot):
+    now = int(time.time())
+    results = {}
+    for item in posters_due_for_check(load_db(), now):
+        file_id = item["poster_file_id"]
+        try:
+            file = await bot.get_file(file_id)
+            results[item["id"]] = (file_id, True, file.file_unique_id)
+        except BadRequest:
+            results[item["id"]] = (file_id, False, None)
+        except TelegramError as e:
+            log.warning("Poster check skipped for %s: %s", item["id"], e)
+
+    if not results:
+        return
+
+    broken = []
+
+    def change(db):
+        for item_id, (file_id, ok, unique_id) in results.items():
+            item = db["items"].get(item_id)
+            if not item or item.get("poster_file_id") != file_id:
+                continue
+            meta = item.get("poster_meta") or {}
+            if not meta.get("unique_id") and unique_id:
+                meta["unique_id"] = unique_id
+            if meta.get("ok", True) and not ok:
+                broken.append(item["title"])
+            meta["ok"] = ok
+            meta["checked_at"] = now
+            item["poster_meta"] = meta
+
+    await mutate_catalog(change, results)
+
+    if broken:
+        try:
+            await bot.send_message(
+                chat_id=ADMIN_ID,
+                text="⚠️ پوستر این آیتم‌ها دیگر معتبر نیست:\n" + "\n".join(broken)
+            )
+        except TelegramError:
+            pass
+
+async def poster_check_loop(bot):
+    while True:
+        await asyncio.sleep(POSTER_CHECK_INTERVAL)
+        if is_overloaded():
+            continue
+        try:
+            await check_posters_once(bot)
+        except Exception as e:
+            log.exception(e)
 
 # ================= RENDERING =================
 
-async def send_item_overview(
-    chat_id: int,
-    item: dict,
-    context: ContextTypes.DEFAULT_TYPE,
-    category_page: int = 0
-):
+def build_overview(item: dict, category_page: int = 0):
     title = item["title"]
     category = item["category"]
     kind = item["kind"]
@@ -310,6 +2036,7 @@ async def send_item_overview(
     text = f"🎬 {title}\n📂 دسته‌بندی: {category}"
 
     common_rows = [
+        [InlineKeyboardButton("📤 اشتراک‌گذاری", switch_inline_query=f"#{item['handle']}")],
         [InlineKeyboardButton("📞 تماس با ادمین", url=f"tg://user?id={ADMIN_ID}")],
         [
             InlineKeyboardButton("⬅️ بازگشت", callback_data=f"back_category:{category}:{category_page}"),
@@ -318,6 +2045,9 @@ async def send_item_overview(
     ]
 
     if kind == "movie":
+        variants = file_variants(item.get("archive_message_id"))
+        if any(any(variant_meta(value).values()) for value in variants):
+            text += "\n📦 " + " | ".join(variant_label(value, index) for index, value in enumerate(variants))
         text += "\n\nبرای دریافت فایل روی دکمه زیر بزن."
         rows = [
             [InlineKeyboardButton("📥 دریافت فایل", callback_data=f"getmovie:{item['id']}")]
@@ -328,82 +2058,165 @@ async def send_item_overview(
         seasons = item.get("seasons", {})
         rows = []
         for season_num in sort_numeric_keys(seasons):
+            if not released_episodes(item, season_num):
+                continue
             rows.append([
                 InlineKeyboardButton(
                     f"فصل {season_num}",
                     callback_data=f"season:{item['id']}:{season_num}:{category_page}"
                 )
             ])
+        rows.append([InlineKeyboardButton("🔔 اطلاع‌رسانی قسمت‌های جدید", callback_data=f"sub_item:{item['id']}")])
         rows += common_rows
         keyboard = InlineKeyboardMarkup(rows)
 
-    poster = item.get("poster_file_id")
-    if poster:
-        await context.bot.send_photo(
-            chat_id=chat_id,
-            photo=poster,
-            caption=text,
-            reply_markup=keyboard
-        )
-    else:
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text=text,
-            reply_markup=keyboard
-        )
+    return text, keyboard
 
-async def send_category_items(chat_id: int, category: str, context: ContextTypes.DEFAULT_TYPE, page: int = 0):
-    db = load_db()
-    items = [
-        item for item in db["items"].values()
-        if item.get("category") == category
-    ]
+async def send_item_overview(
+    chat_id: int,
+    item: dict,
+    context: ContextTypes.DEFAULT_TYPE,
+    category_page: int = 0,
+    message=None,
+):
+    overview = PINNED["overviews"].get((item["id"], category_page))
+    if overview is None:
+        key = response_key("overview", item["id"], category_page)
+        overview = cached_response(key)
+        if overview is None:
+            with span("keyboard"):
+                overview = build_overview(item, category_page)
+            # A caller holding an older snapshot must not fill the new version's entry.
+            if load_db()["items"].get(item["id"]) is item:
+                cache_response(key, overview)
+    text, keyboard = overview
+
+    watched = last_watched(chat_id, item["id"]) if item["kind"] == "series" else None
+    following = next_episode_button(item, *watched) if watched else None
+    if following:
+        # The cached keyboard is shared; the resume row is per user.
+        keyboard = InlineKeyboardMarkup(((following,),) + tuple(keyboard.inline_keyboard))
+
+    if poster_usable(item):
+        poster = item["poster_file_id"]
+        # Hot titles re-use the overview the user is looking at instead of a new
+        # upload: back from a season list shown in place (send_season_episodes).
+        if item["id"] in HOT_DELIVERIES and message is not None and message.photo:
+            try:
+                await message.edit_media(
+                    media=InputMediaPhoto(media=poster, caption=text),
+                    reply_markup=keyboard
+                )
+                return
+            except BadRequest as e:
+                if "not modified" in str(e).lower():
+                    return
+        try:
+            await context.bot.send_photo(
+                chat_id=chat_id,
+                photo=poster,
+                caption=text,
+                reply_markup=keyboard
+            )
+            return
+        except BadRequest as e:
+            log.warning("Poster of %s rejected: %s", item["id"], e)
+            mark_poster_broken(item["id"], poster)
 
-    if not items:
-        await context.bot.send_message(chat_id=chat_id, text="فعلاً چیزی اضافه نشده", reply_markup=contact_admin_button())
-        return
+    await context.bot.send_message(
+        chat_id=chat_id,
+        text=text,
+        reply_markup=keyboard
+    )
 
-    items = sorted(items, key=lambda x: x.get("created_at", 0), reverse=True)
-    page_items, page, pages = paginate_list(items, page)
+async def send_season_episodes(
+    chat_id: int,
+    item: dict,
+    season_num: str,
+    context: ContextTypes.DEFAULT_TYPE,
+    category_page: int = 0,
+    message=None,
+):
+    episodes = released_episodes(item, season_num)
+    if not episodes:
+        await context.bot.send_message(chat_id=chat_id, text="❌ این فصل پیدا نشد")
+        return
 
+    item_id = item["id"]
     rows = []
-    for item in page_items:
+    for ep_num in episodes:
         rows.append([
-            InlineKeyboardButton(item["title"], callback_data=f"item:{item['id']}:{category}:{page}")
+            InlineKeyboardButton(
+                f"قسمت {ep_num}",
+                callback_data=f"episode:{item_id}:{season_num}:{ep_num}"
+            )
         ])
 
-    nav = []
-    if page > 0:
-        nav.append(InlineKeyboardButton("◀️ قبلی", callback_data=f"catpage:{category}:{page-1}"))
-    if page < pages - 1:
-        nav.append(InlineKeyboardButton("بعدی ▶️", callback_data=f"catpage:{category}:{page+1}"))
-    if nav:
-        rows.append(nav)
-
+    rows.append([
+        InlineKeyboardButton("⬅️ بازگشت", callback_data=f"item:{item_id}:{item['category']}:{category_page}")
+    ])
     rows.append([InlineKeyboardButton("🏠 خانه", callback_data="go_home")])
+    text = f"📺 {item['title']}\nفصل {season_num}\nقسمت موردنظر را انتخاب کن:"
+
+    # Hot titles turn the overview photo into the season list; its back
+    # button then edits the overview back in instead of sending it again.
+    if item_id in HOT_DELIVERIES and message is not None and message.photo:
+        try:
+            await message.edit_caption(caption=text, reply_markup=InlineKeyboardMarkup(rows))
+            return
+        except BadRequest as e:
+            if "not modified" in str(e).lower():
+                return
 
     await context.bot.send_message(
         chat_id=chat_id,
-        text=f"📂 {category}\nصفحه {page+1} از {pages}\nیکی را انتخاب کن:",
+        text=text,
         reply_markup=InlineKeyboardMarkup(rows)
     )
 
-async def send_search_results(chat_id: int, query_text: str, context: ContextTypes.DEFAULT_TYPE, page: int = 0):
+async def send_category_items(chat_id: int, category: str, context: ContextTypes.DEFAULT_TYPE, page: int = 0):
     db = load_db()
-    q = query_text.strip().lower()
+    category = resolve_category(db, category)
 
-    results = []
-    for item in db["items"].values():
-        title = item.get("title", "").lower()
-        category = item.get("category", "").lower()
-        if q in title or q in category:
-            results.append(item)
+    if not INDEX["by_category"].get(category):
+        await context.bot.send_message(chat_id=chat_id, text="فعلاً چیزی اضافه نشده", reply_markup=contact_admin_button())
+        return
+
+    with span("keyboard"):
+        text, markup = category_page_response(db, category, page)
+
+    await context.bot.send_message(chat_id=chat_id, text=text, reply_markup=markup)
+
+async def send_search_results(chat_id: int, query_text: str, context: ContextTypes.DEFAULT_TYPE, page: int = 0):
+    db = load_db()
+    with span("search"):
+        results = [db["items"][item_id] for item_id in substring_search(query_text)]
 
     if not results:
-        await context.bot.send_message(chat_id=chat_id, text="❌ نتیجه‌ای پیدا نشد", reply_markup=contact_admin_button())
+        with span("search.fuzzy"):
+            # Fuzzy matching is the expensive part of search; skip it under load.
+            suggestions = [] if is_overloaded() else fuzzy_search(query_text)
+        if not suggestions:
+            await context.bot.send_message(chat_id=chat_id, text="❌ نتیجه‌ای پیدا نشد", reply_markup=contact_admin_button())
+            return
+
+        rows = []
+        for item_id in suggestions:
+            item = db["items"][item_id]
+            rows.append([
+                InlineKeyboardButton(
+                    f"{item['title']} | {item['category']}",
+                    callback_data=f"searchitem:{item_id}:0"
+                )
+            ])
+        rows.append([InlineKeyboardButton("🏠 خانه", callback_data="go_home")])
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text=f"❌ نتیجه‌ای برای «{query_text}» پیدا نشد.\n❓ منظورت یکی از این‌ها بود؟",
+            reply_markup=InlineKeyboardMarkup(rows)
+        )
         return
 
-    results = sorted(results, key=lambda x: x.get("created_at", 0), reverse=True)
     page_items, page, pages = paginate_list(results, page)
 
     rows = []
@@ -431,75 +2244,161 @@ async def send_search_results(chat_id: int, query_text: str, context: ContextTyp
         reply_markup=InlineKeyboardMarkup(rows)
     )
 
-async def send_delete_page(chat_id: int, context: ContextTypes.DEFAULT_TYPE, page: int = 0):
-    db = load_db()
-    items = sorted(db["items"].values(), key=lambda x: x.get("created_at", 0), reverse=True)
+# Admin browser filters: a = all, m = movies, s = series, p = no poster,
+# f = missing/broken files, c<category_key> = one category, q = title search.
+# Unlike the user-facing lists these include scheduled items.
+ADMIN_FILTER_LABELS = {
+    "a": "همه",
+    "m": "فیلم‌ها",
+    "s": "سریال‌ها",
+    "p": "بدون پوستر",
+    "f": "فایل ناقص",
+    "t": "⏰ زمان‌بندی‌شده",
+}
+
+def admin_filter_ids(token: str, query_text: str = ""):
+    if token == "m":
+        return INDEX["admin"]["movie"]
+    if token == "s":
+        return INDEX["admin"]["series"]
+    if token == "p":
+        return INDEX["admin"]["no_poster"]
+    if token == "t":
+        return INDEX["admin"]["scheduled"]
+    if token == "f":
+        # Structural problems from the index plus what the auditor found.
+        ids = set(INDEX["admin"]["no_files"]) | set(load_audit_report()["broken"])
+        return [item_id for item_id in INDEX["all"] if item_id in ids]
+    if is_category_token(token):
+        return INDEX["by_category"].get(admin_filter_category(token), [])
+    if token == "q":
+        return admin_title_search(query_text)
+    return INDEX["all"]
+
+def admin_title_search(query_text: str):
+    q = normalize_text(query_text)
+    if not q:
+        return []
+    items = load_db()["items"]
+    titles = INDEX["fuzzy_titles"]
+    # Released titles are already normalized in the search index.
+    return [
+        item_id for item_id in INDEX["all"]
+        if q in (titles[item_id][0] if item_id in titles else normalize_text(items[item_id].get("title", "")))
+    ]
 
-    if not items:
-        await context.bot.send_message(chat_id=chat_id, text="❌ چیزی برای حذف وجود ندارد")
-        return
+def is_category_token(token: str):
+    return token.startswith("c") and token != "cats"
 
-    page_items, page, pages = paginate_list(items, page)
+def admin_filter_category(token: str):
+    # "c<category_key>" tokens; None once the category is renamed or removed.
+    return INDEX["category_keys"].get(token[1:])
 
-    rows = []
-    for item in page_items:
-        rows.append([
-            InlineKeyboardButton(
-                f"🗑 {item['title']}",
-                callback_data=f"delete_item:{item['id']}:{page}"
-            )
-        ])
+def admin_filter_label(token: str, query_text: str = ""):
+    if is_category_token(token):
+        return admin_filter_category(token) or "دسته‌بندی حذف‌شده"
+    if token == "q":
+        return f"«{query_text}»"
+    return ADMIN_FILTER_LABELS.get(token, ADMIN_FILTER_LABELS["a"])
 
-    nav = []
-    if page > 0:
-        nav.append(InlineKeyboardButton("◀️ قبلی", callback_data=f"admin_del_page:{page-1}"))
-    if page < pages - 1:
-        nav.append(InlineKeyboardButton("بعدی ▶️", callback_data=f"admin_del_page:{page+1}"))
-    if nav:
-        rows.append(nav)
+def admin_filter_rows(prefix: str):
+    return [
+        [
+            InlineKeyboardButton(ADMIN_FILTER_LABELS[t], callback_data=f"{prefix}:{t}")
+            for t in ("a", "m", "s")
+        ],
+        [
+            InlineKeyboardButton(ADMIN_FILTER_LABELS["p"], callback_data=f"{prefix}:p"),
+            InlineKeyboardButton(ADMIN_FILTER_LABELS["f"], callback_data=f"{prefix}:f"),
+            InlineKeyboardButton(ADMIN_FILTER_LABELS["t"], callback_data=f"{prefix}:t"),
+            InlineKeyboardButton("📂 دسته‌ها", callback_data=f"{prefix}:cats"),
+        ],
+    ]
 
-    rows.append([InlineKeyboardButton("🏠 خانه", callback_data="go_home")])
+async def send_admin_category_filters(chat_id: int, context: ContextTypes.DEFAULT_TYPE, prefix: str):
+    rows = [
+        [InlineKeyboardButton(f"{name} ({len(INDEX['by_category'].get(name, []))})", callback_data=f"{prefix}:c{category_key(name)}")]
+        for name in INDEX["category_names"]
+    ]
+    await context.bot.send_message(chat_id=chat_id, text="فیلتر دسته‌بندی:", reply_markup=InlineKeyboardMarkup(rows))
 
-    await context.bot.send_message(
-        chat_id=chat_id,
-        text=f"حذف آیتم - صفحه {page+1} از {pages}",
-        reply_markup=InlineKeyboardMarkup(rows)
-    )
+def set_admin_filter(context: ContextTypes.DEFAULT_TYPE, mode: str, token: str, query_text: str = None):
+    context.user_data.setdefault("admin_filter", {})[mode] = token
+    if query_text is not None:
+        context.user_data["admin_query"] = query_text
 
-async def send_edit_page(chat_id: int, context: ContextTypes.DEFAULT_TYPE, page: int = 0):
+def admin_page_content(context: ContextTypes.DEFAULT_TYPE, mode: str, page: int = 0):
+    # Returns (text, markup), or (text, None) when there is nothing to list.
     db = load_db()
-    items = sorted(db["items"].values(), key=lambda x: x.get("created_at", 0), reverse=True)
+    token = context.user_data.get("admin_filter", {}).get(mode, "a")
+    query_text = context.user_data.get("admin_query", "")
+    ids = admin_filter_ids(token, query_text)
+    # Multi-select only exists on the delete pages, which on_callback owns.
+    multi = mode == "delete" and context.user_data.get("admin_multi", False)
+    selected = context.user_data.get("admin_selected", set())
+
+    if mode == "delete":
+        title, icon, item_cb, page_cb, filter_cb = "حذف آیتم", "🗑", "delete_item", "admin_del_page", "admin_del_filter"
+    else:
+        title, icon, item_cb, page_cb, filter_cb = "ویرایش آیتم", "✏️", "edit_item", "admin_edit_page", "admin_edit_filter"
 
-    if not items:
-        await context.bot.send_message(chat_id=chat_id, text="❌ چیزی برای ویرایش وجود ندارد")
-        return
+    if not ids and token == "a":
+        empty = "❌ چیزی برای حذف وجود ندارد" if mode == "delete" else "❌ چیزی برای ویرایش وجود ندارد"
+        return empty, None
 
-    page_items, page, pages = paginate_list(items, page)
+    page_ids, page, pages = paginate_list(ids, page)
 
     rows = []
-    for item in page_items:
-        rows.append([
-            InlineKeyboardButton(
-                f"✏️ {item['title']}",
-                callback_data=f"edit_item:{item['id']}:{page}"
-            )
-        ])
+    for item_id in page_ids:
+        if multi:
+            mark = "✅" if item_id in selected else "⬜"
+            button = InlineKeyboardButton(f"{mark} {db['items'][item_id]['title']}", callback_data=f"admin_sel:{item_id}:{page}")
+        else:
+            button = InlineKeyboardButton(f"{icon} {db['items'][item_id]['title']}", callback_data=f"{item_cb}:{item_id}:{page}")
+        rows.append([button])
 
     nav = []
     if page > 0:
-        nav.append(InlineKeyboardButton("◀️ قبلی", callback_data=f"admin_edit_page:{page-1}"))
+        nav.append(InlineKeyboardButton("◀️ قبلی", callback_data=f"{page_cb}:{page-1}"))
     if page < pages - 1:
-        nav.append(InlineKeyboardButton("بعدی ▶️", callback_data=f"admin_edit_page:{page+1}"))
+        nav.append(InlineKeyboardButton("بعدی ▶️", callback_data=f"{page_cb}:{page+1}"))
     if nav:
         rows.append(nav)
 
+    rows += admin_filter_rows(filter_cb)
+    if mode == "delete":
+        if multi:
+            if selected:
+                rows.append([
+                    InlineKeyboardButton(f"🗑 حذف ({len(selected)})", callback_data="admin_bulk:delete"),
+                    InlineKeyboardButton("📂 انتقال", callback_data="admin_bulk:move"),
+                    InlineKeyboardButton("🖼 حذف پوستر", callback_data="admin_bulk:poster"),
+                ])
+                rows.append([InlineKeyboardButton("✖️ پاک کردن انتخاب", callback_data=f"admin_bulk:clear:{page}")])
+            rows.append([InlineKeyboardButton("↩️ خروج از انتخاب چندتایی", callback_data=f"admin_multi:{page}")])
+        else:
+            rows.append([InlineKeyboardButton("☑️ انتخاب چندتایی", callback_data=f"admin_multi:{page}")])
     rows.append([InlineKeyboardButton("🏠 خانه", callback_data="go_home")])
 
-    await context.bot.send_message(
-        chat_id=chat_id,
-        text=f"ویرایش آیتم - صفحه {page+1} از {pages}",
-        reply_markup=InlineKeyboardMarkup(rows)
-    )
+    header = f"{title} - صفحه {page+1} از {pages}"
+    if token != "a":
+        header += f"\nفیلتر: {admin_filter_label(token, query_text)} ({len(ids)})"
+    if multi:
+        header += f"\nانتخاب‌شده: {len(selected)}"
+    if not ids:
+        header += "\nموردی پیدا نشد"
+
+    return header, InlineKeyboardMarkup(rows)
+
+async def send_admin_page(chat_id: int, context: ContextTypes.DEFAULT_TYPE, mode: str, page: int = 0):
+    text, markup = admin_page_content(context, mode, page)
+    await context.bot.send_message(chat_id=chat_id, text=text, reply_markup=markup)
+
+async def send_delete_page(chat_id: int, context: ContextTypes.DEFAULT_TYPE, page: int = 0):
+    await send_admin_page(chat_id, context, "delete", page)
+
+async def send_edit_page(chat_id: int, context: ContextTypes.DEFAULT_TYPE, page: int = 0):
+    await send_admin_page(chat_id, context, "edit", page)
 
 async def send_edit_fields(chat_id: int, item: dict, page: int, context: ContextTypes.DEFAULT_TYPE):
     rows = [
@@ -523,10 +2422,53 @@ async def send_edit_fields(chat_id: int, item: dict, page: int, context: Context
 
 # ================= START / CANCEL =================
 
+async def open_start_payload(chat_id: int, payload: str, context: ContextTypes.DEFAULT_TYPE):
+    parsed = parse_start_payload(payload)
+    if not parsed:
+        return False
+
+    handle, season_num, ep_num = parsed
+    db = load_db()
+    item = item_by_handle(db, handle)
+    if not item:
+        return False
+
+    if season_num is None or item["kind"] != "series":
+        await send_item_overview(chat_id, item, context)
+        return True
+
+    if ep_num is None:
+        await send_season_episodes(chat_id, item, season_num, context)
+        return True
+
+    msg_id = resolve_archive_message_id(item, season_num, ep_num)
+    if not msg_id:
+        await send_item_overview(chat_id, item, context)
+        return True
+
+    await copy_archive_message_and_schedule_delete(
+        chat_id=chat_id,
+        archive_message_id=msg_id,
+        item_id=item["id"],
+        season_num=season_num,
+        episode_num=ep_num,
+        context=context,
+    )
+    return True
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    payload = context.args[0] if context.args else ""
     if not await ensure_joined(update, context):
+        # Opened after the join check passes.
+        if payload:
+            context.user_data["start_payload"] = payload
         return
     context.user_data["mode"] = None
+    context.user_data.pop("start_payload", None)
+
+    if payload and await open_start_payload(update.effective_chat.id, payload, context):
+        return
+
     await update.message.reply_text("👋 خوش آمدی", reply_markup=kb_main())
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -538,12 +2480,69 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # ================= LAST =================
 
+async def send_feed_page(chat_id: int, context: ContextTypes.DEFAULT_TYPE, mode: str, limit: int = 0, page: int = 0):
+    db = load_db()
+    feed = released_feed(db["recent"])
+
+    if mode == "week":
+        end = feed_cutoff(feed, int(time.time()) - RECENT_WINDOW)
+        header = "🆕 جدیدهای این هفته"
+        empty = "❌ این هفته چیزی اضافه نشده"
+    else:
+        end = min(limit, len(feed))
+        header = f"🆕 {end} آیتم آخر"
+        empty = "❌ هنوز چیزی ثبت نشده"
+
+    if not end:
+        await context.bot.send_message(chat_id=chat_id, text=empty)
+        return
+
+    pages = max(1, math.ceil(end / PAGE_SIZE))
+    page = max(0, min(page, pages - 1))
+    start = page * PAGE_SIZE
+
+    rows = []
+    for item_id, _ in feed[start:min(start + PAGE_SIZE, end)]:
+        item = db["items"].get(item_id)
+        if not item:
+            continue
+        rows.append([
+            InlineKeyboardButton(
+                f"{item['title']} | {item['category']}",
+                callback_data=f"item:{item_id}:{item['category']}:0"
+            )
+        ])
+
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("◀️ قبلی", callback_data=f"feed:{mode}:{limit}:{page-1}"))
+    if page < pages - 1:
+        nav.append(InlineKeyboardButton("بعدی ▶️", callback_data=f"feed:{mode}:{limit}:{page+1}"))
+    if nav:
+        rows.append(nav)
+
+    rows.append([InlineKeyboardButton("🏠 خانه", callback_data="go_home")])
+
+    await context.bot.send_message(
+        chat_id=chat_id,
+        text=f"{header}\nصفحه {page+1} از {pages}",
+        reply_markup=InlineKeyboardMarkup(rows)
+    )
+
 async def last(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await ensure_joined(update, context):
         return
 
+    if context.args and context.args[0].isdigit():
+        limit = max(1, min(int(context.args[0]), RECENT_LIMIT))
+        await send_feed_page(update.effective_chat.id, context, "last", limit)
+        return
+
     db = load_db()
-    latest_id = db.get("latest_item_id")
+    # Read from the feed rather than latest_item_id, which is only updated
+    # by writes and so misses releases that were scheduled.
+    feed = released_feed(db["recent"])
+    latest_id = feed[0][0] if feed else None
 
     if not latest_id or latest_id not in db["items"]:
         await update.message.reply_text("❌ هنوز چیزی ثبت نشده")
@@ -552,6 +2551,11 @@ async def last(update: Update, context: ContextTypes.DEFAULT_TYPE):
     item = db["items"][latest_id]
     await send_item_overview(update.effective_chat.id, item, context)
 
+async def new_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await ensure_joined(update, context):
+        return
+    await send_feed_page(update.effective_chat.id, context, "week")
+
 # ================= SEARCH =================
 
 async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -563,6 +2567,71 @@ async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         reply_markup=ReplyKeyboardMarkup([[BACK_BTN], [HOME_BTN]], resize_keyboard=True)
     )
 
+# ================= INLINE =================
+
+def item_deep_link(bot_username: str, item: dict, season_num: str = None, episode_num: str = None):
+    return f"https://t.me/{bot_username}?start={start_payload(item, season_num, episode_num)}"
+
+def inline_result(item: dict, bot_username: str):
+    text = f"🎬 {item['title']}\n📂 دسته‌بندی: {item['category']}"
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("🎬 مشاهده در ربات", url=item_deep_link(bot_username, item))]
+    ])
+    if poster_usable(item):
+        return InlineQueryResultCachedPhoto(
+            id=item["handle"],
+            photo_file_id=item["poster_file_id"],
+            title=item["title"],
+            description=item["category"],
+            caption=text,
+            reply_markup=keyboard,
+        )
+    return InlineQueryResultArticle(
+        id=item["handle"],
+        title=item["title"],
+        description=item["category"],
+        input_message_content=InputTextMessageContent(text),
+        reply_markup=keyboard,
+    )
+
+def inline_answer(query_text: str, offset: int, bot_username: str):
+    db = load_db()
+    normalized = normalize_text(query_text)
+    key = response_key("inline", normalized, offset)
+    cached = cached_response(key)
+    if cached is not None:
+        return cached
+
+    shared = item_by_handle(db, normalized[1:]) if normalized.startswith("#") else None
+    if shared:
+        ids = [shared["id"]]
+    elif normalized:
+        ids = substring_search(normalized)
+        if not ids and not is_overloaded():
+            ids = fuzzy_search(normalized, INLINE_PAGE_SIZE)
+    else:
+        ids = [item_id for item_id, _ in released_feed(db["recent"])]
+
+    page_ids = ids[offset:offset + INLINE_PAGE_SIZE]
+    results = [inline_result(db["items"][item_id], bot_username) for item_id in page_ids]
+    next_offset = str(offset + INLINE_PAGE_SIZE) if offset + INLINE_PAGE_SIZE < len(ids) else ""
+
+    if is_overloaded():
+        # Possibly missing fuzzy matches; don't keep this past the spike.
+        return results, next_offset
+    return cache_response(key, (results, next_offset))
+
+async def on_inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.inline_query
+    offset = int(query.offset) if query.offset.isdigit() else 0
+    results, next_offset = inline_answer(query.query, offset, context.bot.username)
+    await query.answer(
+        results,
+        cache_time=INLINE_CACHE_TIME,
+        is_personal=False,
+        next_offset=next_offset,
+    )
+
 # ================= USER TEXT =================
 
 async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -585,10 +2654,13 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("🏠 منوی اصلی", reply_markup=kb_main())
         return
 
-    if text not in CATEGORIES:
+    db = load_db()
+    # Menus cached on the user's client may still show renamed categories.
+    category = resolve_category(db, text)
+    if category not in INDEX["category_names"]:
         return
 
-    await send_category_items(update.effective_chat.id, text, context, page=0)
+    await send_category_items(update.effective_chat.id, category, context, page=0)
 
 # ================= CALLBACKS =================
 
@@ -603,6 +2675,9 @@ async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if data == "check_join":
         if await is_joined_required_channel(user_id, context):
             await query.message.reply_text("✅ عضویت شما تایید شد", reply_markup=kb_main())
+            payload = context.user_data.pop("start_payload", None)
+            if payload:
+                await open_start_payload(query.message.chat_id, payload, context)
         else:
             await query.message.reply_text("❌ هنوز عضو کانال نشده‌اید")
         return
@@ -624,10 +2699,10 @@ async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if data.startswith("item:"):
             _, item_id, category, page = data.split(":", 3)
             item = db["items"].get(item_id)
-            if not item:
+            if not item or not is_released(item):
                 await query.message.reply_text("❌ آیتم پیدا نشد")
                 return
-            await send_item_overview(query.message.chat_id, item, context, category_page=int(page))
+            await send_item_overview(query.message.chat_id, item, context, category_page=int(page), message=query.message)
             return
 
         if data.startswith("back_category:"):
@@ -638,34 +2713,11 @@ async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if data.startswith("season:"):
             _, item_id, season_num, category_page = data.split(":", 3)
             item = db["items"].get(item_id)
-            if not item:
+            if not item or not is_released(item):
                 await query.message.reply_text("❌ سریال پیدا نشد")
                 return
 
-            seasons = item.get("seasons", {})
-            if season_num not in seasons:
-                await query.message.reply_text("❌ این فصل پیدا نشد")
-                return
-
-            episodes = seasons[season_num]
-            rows = []
-            for ep_num in sort_numeric_keys(episodes):
-                rows.append([
-                    InlineKeyboardButton(
-                        f"قسمت {ep_num}",
-                        callback_data=f"episode:{item_id}:{season_num}:{ep_num}"
-                    )
-                ])
-
-            rows.append([
-                InlineKeyboardButton("⬅️ بازگشت", callback_data=f"item:{item_id}:{item['category']}:{category_page}")
-            ])
-            rows.append([InlineKeyboardButton("🏠 خانه", callback_data="go_home")])
-
-            await query.message.reply_text(
-                f"📺 {item['title']}\nفصل {season_num}\nقسمت موردنظر را انتخاب کن:",
-                reply_markup=InlineKeyboardMarkup(rows)
-            )
+            await send_season_episodes(query.message.chat_id, item, season_num, context, int(category_page), message=query.message)
             return
 
         if data.startswith("episode:"):
@@ -675,7 +2727,7 @@ async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await query.message.reply_text("❌ آیتم پیدا نشد")
                 return
 
-            msg_id = item.get("seasons", {}).get(season_num, {}).get(ep_num)
+            msg_id = resolve_archive_message_id(item, season_num, ep_num)
             if not msg_id:
                 await query.message.reply_text("❌ فایل این قسمت ثبت نشده")
                 return
@@ -693,28 +2745,56 @@ async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if data.startswith("getmovie:"):
             item_id = data.split(":", 1)[1]
             item = db["items"].get(item_id)
-            if not item:
+            if not item or not is_released(item):
                 await query.message.reply_text("❌ فیلم پیدا نشد")
                 return
 
             await copy_archive_message_and_schedule_delete(
                 chat_id=query.message.chat_id,
-                archive_message_id=item["archive_message_id"],
+                archive_message_id=resolve_archive_message_id(item),
+                item_id=item_id,
+                context=context,
+            )
+            return
+
+        if data.startswith("variant:"):
+            _, item_id, season_num, ep_num, index = data.split(":", 4)
+            season_num = None if season_num == "-" else season_num
+            ep_num = None if ep_num == "-" else ep_num
+            item = db["items"].get(item_id)
+            msg_id = resolve_archive_message_id(item, season_num, ep_num) if item else None
+            if not msg_id:
+                await query.message.reply_text("❌ فایل پیدا نشد")
+                return
+
+            variants = file_variants(msg_id)
+            index = int(index)
+            if index < len(variants) and variant_meta(variants[index])["q"]:
+                context.user_data.setdefault("quality", {})[item_id] = variant_meta(variants[index])["q"]
+            await copy_archive_message_and_schedule_delete(
+                chat_id=query.message.chat_id,
+                archive_message_id=msg_id,
                 item_id=item_id,
+                season_num=season_num,
+                episode_num=ep_num,
                 context=context,
+                variant=index,
             )
             return
 
         if data.startswith("redownload_movie:"):
             item_id = data.split(":", 1)[1]
             item = db["items"].get(item_id)
-            if not item:
+            if not item or not is_released(item):
                 await query.message.reply_text("❌ فیلم پیدا نشد")
                 return
 
+            # Downloading again is also how a user switches quality.
+            context.user_data.get("quality", {}).pop(item_id, None)
+
             await copy_archive_message_and_schedule_delete(
                 chat_id=query.message.chat_id,
-                archive_message_id=item["archive_message_id"],
+                archive_message_id=resolve_archive_message_id(item),
                 item_id=item_id,
                 context=context,
             )
@@ -727,11 +2807,12 @@ async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await query.message.reply_text("❌ آیتم پیدا نشد")
                 return
 
-            msg_id = item.get("seasons", {}).get(season_num, {}).get(ep_num)
+            msg_id = resolve_archive_message_id(item, season_num, ep_num)
             if not msg_id:
                 await query.message.reply_text("❌ فایل این قسمت ثبت نشده")
                 return
 
+            context.user_data.get("quality", {}).pop(item_id, None)
             await copy_archive_message_and_schedule_delete(
                 chat_id=query.message.chat_id,
                 archive_message_id=msg_id,
@@ -753,7 +2834,26 @@ async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             if not item:
                 await query.message.reply_text("❌ آیتم پیدا نشد")
                 return
-            await send_item_overview(query.message.chat_id, item, context, category_page=0)
+            await send_item_overview(query.message.chat_id, item, context, category_page=0, message=query.message)
+            return
+
+        if data.startswith("feed:"):
+            _, mode, limit, page = data.split(":", 3)
+            await send_feed_page(query.message.chat_id, context, mode, int(limit), int(page))
+            return
+
+        if data.startswith("sub_cat:") or data.startswith("sub_item:"):
+            kind, value = data.split(":", 1)
+            if kind == "sub_cat":
+                subscribed = toggle_subscription(user_id, "categories", value)
+                name = value
+            else:
+                subscribed = toggle_subscription(user_id, "items", value)
+                name = db["items"].get(value, {}).get("title", value)
+            if subscribed:
+                await query.message.reply_text(f"🔔 اطلاع‌رسانی «{name}» فعال شد")
+            else:
+                await query.message.reply_text(f"🔕 اطلاع‌رسانی «{name}» غیرفعال شد")
             return
 
         if data.startswith("admin_del_page:"):
@@ -764,6 +2864,28 @@ async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await send_delete_page(query.message.chat_id, context, int(page))
             return
 
+        if data.startswith("admin_del_filter:"):
+            if not is_admin_user(user_id):
+                await query.message.reply_text("⛔ فقط ادمین")
+                return
+            _, token = data.split(":", 1)
+            if token == "cats":
+                await send_admin_category_filters(query.message.chat_id, context, "admin_del_filter")
+                return
+            if is_category_token(token) and admin_filter_category(token) is None:
+                await query.message.reply_text("❌ دسته‌بندی پیدا نشد")
+                return
+            set_admin_filter(context, "delete", token)
+            await send_delete_page(query.message.chat_id, context, 0)
+            return
+
+        if data.startswith(("admin_multi:", "admin_sel:", "admin_bulk:")):
+            if not is_admin_user(user_id):
+                await query.message.reply_text("⛔ فقط ادمین")
+                return
+            await on_admin_bulk(query, context, data)
+            return
+
         if data.startswith("delete_item:"):
             if not is_admin_user(user_id):
                 await query.message.reply_text("⛔ فقط ادمین")
@@ -775,12 +2897,7 @@ async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 return
 
             title = db["items"][item_id]["title"]
-            del db["items"][item_id]
-
-            if db.get("latest_item_id") == item_id:
-                db["latest_item_id"] = next(iter(db["items"]), None)
-
-            save_db(db)
+            await mutate_catalog(lambda catalog: bulk_delete(catalog, [item_id]), [item_id])
             await query.message.reply_text(f"✅ حذف شد: {title}")
             await send_delete_page(query.message.chat_id, context, int(page))
             return
@@ -791,6 +2908,14 @@ async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # ================= ADMIN ADD =================
 
+def add_item(db: dict, item: dict):
+    assign_handle(db, item)
+    db["items"][item["id"]] = item
+    feed_push(db, item["id"], item["created_at"])
+    count_category(db, item["category"], 1)
+    sync_latest_item(db)
+    announce(db, item, publish_at=item.get("publish_at"))
+
 async def add_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin_update(update):
         await update.message.reply_text("⛔ فقط ادمین می‌تواند استفاده کند")
@@ -832,7 +2957,7 @@ async def add_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return ADD_KIND
 
-    if text not in CATEGORIES:
+    if text not in INDEX["category_names"]:
         await update.message.reply_text("یکی از دسته‌بندی‌های موجود را انتخاب کن")
         return ADD_CATEGORY
 
@@ -868,11 +2993,12 @@ async def add_title(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def add_skip_poster(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data["add_data"]["poster_file_id"] = None
+    context.user_data["add_data"]["poster_meta"] = None
     add_data = context.user_data["add_data"]
 
     if add_data["kind"] == "movie":
         await update.message.reply_text(
-            "فایل فیلم را از کانال آرشیو به ربات فوروارد کن یا message_id آن را بفرست.",
+            "فایل فیلم را از کانال آرشیو به ربات فوروارد کن یا message_id آن را بفرست.\nبرای چند کیفیت، شناسه‌ها را با کاما جدا کن.",
             reply_markup=kb_cancel()
         )
         return ADD_MOVIE_FILE
@@ -890,12 +3016,13 @@ async def add_poster(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     photo = update.message.photo[-1]
     context.user_data["add_data"]["poster_file_id"] = photo.file_id
+    context.user_data["add_data"]["poster_meta"] = poster_meta_from_photo(photo)
 
     add_data = context.user_data["add_data"]
 
     if add_data["kind"] == "movie":
         await update.message.reply_text(
-            "فایل فیلم را از کانال آرشیو به ربات فوروارد کن یا message_id آن را بفرست.",
+            "فایل فیلم را از کانال آرشیو به ربات فوروارد کن یا message_id آن را بفرست.\nبرای چند کیفیت، شناسه‌ها را با کاما جدا کن.",
             reply_markup=kb_cancel()
         )
         return ADD_MOVIE_FILE
@@ -933,19 +3060,17 @@ async def add_movie_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "category": add_data["category"],
         "kind": "movie",
         "poster_file_id": add_data.get("poster_file_id"),
+        "poster_meta": add_data.get("poster_meta"),
         "archive_message_id": add_data["archive_message_id"],
         "created_at": int(time.time()),
     }
 
-    db = load_db()
-    db["items"][item_id] = item
-    db["latest_item_id"] = item_id
-    save_db(db)
+    await mutate_catalog(lambda db: add_item(db, apply_publish_slot(context, item)), [item_id])
 
     context.user_data.pop("add_data", None)
 
     await update.message.reply_text(
-        "✅ فیلم با موفقیت ثبت شد",
+        "✅ فیلم با موفقیت ثبت شد" + publish_note(item.get("publish_at")),
         reply_markup=kb_main()
     )
     return ConversationHandler.END
@@ -998,7 +3123,7 @@ async def add_series_episode_count(update: Update, context: ContextTypes.DEFAULT
     episode_num = add_data["current_episode"]
 
     await update.message.reply_text(
-        f"فایل قسمت {episode_num} از فصل {season_num} را از کانال آرشیو فوروارد کن یا message_id آن را بفرست.",
+        f"فایل قسمت {episode_num} از فصل {season_num} را از کانال آرشیو فوروارد کن یا message_id آن را بفرست.\nبرای چند کیفیت، شناسه‌ها را با کاما جدا کن.",
         reply_markup=kb_cancel()
     )
     return ADD_SERIES_EPISODE_FILE
@@ -1048,29 +3173,140 @@ async def add_series_episode_file(update: Update, context: ContextTypes.DEFAULT_
         "category": add_data["category"],
         "kind": "series",
         "poster_file_id": add_data.get("poster_file_id"),
+        "poster_meta": add_data.get("poster_meta"),
         "seasons": add_data["seasons"],
         "created_at": int(time.time()),
     }
 
-    db = load_db()
-    db["items"][item_id] = item
-    db["latest_item_id"] = item_id
-    save_db(db)
+    await mutate_catalog(lambda db: add_item(db, apply_publish_slot(context, item)), [item_id])
 
     context.user_data.pop("add_data", None)
 
     await update.message.reply_text(
-        "✅ سریال با موفقیت ثبت شد",
+        "✅ سریال با موفقیت ثبت شد" + publish_note(item.get("publish_at")),
         reply_markup=kb_main()
     )
     return ConversationHandler.END
 
-# ================= ADMIN DELETE =================
+# ================= ADMIN DELETE =================
+
+# Bulk operations take the admin's selection and apply it as one catalog
+# mutation followed by a single save.
+def bulk_delete(db: dict, item_ids):
+    deleted = [db["items"].pop(item_id) for item_id in item_ids if item_id in db["items"]]
+    for item in deleted:
+        count_category(db, item["category"], -1)
+    gone = {item["id"] for item in deleted}
+    db["recent"] = [entry for entry in db["recent"] if entry[0] not in gone]
+    sync_latest_item(db)
+    return len(deleted)
+
+def bulk_move(db: dict, item_ids, category: str):
+    moved = 0
+    for item_id in item_ids:
+        item = db["items"].get(item_id)
+        if item and item["category"] != category:
+            count_category(db, item["category"], -1)
+            count_category(db, category, 1)
+            item["category"] = category
+            moved += 1
+    return moved
+
+def bulk_clear_poster(db: dict, item_ids):
+    cleared = 0
+    for item_id in item_ids:
+        item = db["items"].get(item_id)
+        if item and item.get("poster_file_id"):
+            item["poster_file_id"] = None
+            item["poster_meta"] = None
+            cleared += 1
+    return cleared
+
+async def refresh_admin_page(query, context: ContextTypes.DEFAULT_TYPE, page: int):
+    text, markup = admin_page_content(context, "delete", page)
+    try:
+        await query.edit_message_text(text, reply_markup=markup)
+    except BadRequest as e:
+        if "not modified" not in str(e).lower():
+            raise
+
+async def on_admin_bulk(query, context: ContextTypes.DEFAULT_TYPE, data: str):
+    selected = context.user_data.setdefault("admin_selected", set())
+
+    if data.startswith("admin_multi:"):
+        page = int(data.split(":", 1)[1])
+        context.user_data["admin_multi"] = not context.user_data.get("admin_multi", False)
+        await refresh_admin_page(query, context, page)
+        return
+
+    if data.startswith("admin_sel:"):
+        _, item_id, page = data.split(":", 2)
+        selected.symmetric_difference_update({item_id})
+        await refresh_admin_page(query, context, int(page))
+        return
+
+    action = data.split(":")[1:]
+    if action[0] == "clear":
+        selected.clear()
+        await refresh_admin_page(query, context, int(action[1]))
+        return
+    if action == ["cancel"]:
+        # Drop the confirmation only; the selection stays for another action.
+        try:
+            await query.message.delete()
+        except BadRequest:
+            await query.edit_message_text("❎ لغو شد")
+        return
+
+    if not selected:
+        await query.message.reply_text("❌ چیزی انتخاب نشده")
+        return
+
+    if action == ["delete"]:
+        await query.message.reply_text(
+            f"⚠️ {len(selected)} آیتم حذف شود؟",
+            reply_markup=InlineKeyboardMarkup([[
+                InlineKeyboardButton("✅ بله، حذف کن", callback_data="admin_bulk:delete:yes"),
+                InlineKeyboardButton("❌ نه", callback_data="admin_bulk:cancel"),
+            ]])
+        )
+        return
+    if action == ["move"]:
+        rows = [
+            [InlineKeyboardButton(name, callback_data=f"admin_bulk:move:c{category_key(name)}")]
+            for name in INDEX["category_names"]
+        ]
+        await query.message.reply_text(f"{len(selected)} آیتم به کدام دسته‌بندی برود؟", reply_markup=InlineKeyboardMarkup(rows))
+        return
+
+    item_ids = set(selected)
+    if action == ["delete", "yes"]:
+        count = await mutate_catalog(lambda db: bulk_delete(db, item_ids), item_ids)
+        result = f"✅ {count} آیتم حذف شد"
+    elif action[0] == "move" and len(action) == 2 and is_category_token(action[1]):
+        category = admin_filter_category(action[1])
+        if category is None:
+            await query.message.reply_text("❌ دسته‌بندی پیدا نشد")
+            return
+        count = await mutate_catalog(lambda db: bulk_move(db, item_ids, category), item_ids)
+        result = f"✅ {count} آیتم به «{category}» منتقل شد"
+    elif action == ["poster"]:
+        count = await mutate_catalog(lambda db: bulk_clear_poster(db, item_ids), item_ids)
+        result = f"✅ پوستر {count} آیتم حذف شد"
+    else:
+        return
+
+    selected.clear()
+    await query.message.reply_text(result)
+    await send_delete_page(query.message.chat_id, context, 0)
 
 async def delete_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin_update(update):
         await update.message.reply_text("⛔ فقط ادمین")
         return
+    # "/delete <title>" searches within the admin view.
+    query_text = " ".join(context.args)
+    set_admin_filter(context, "delete", "q" if query_text else "a", query_text)
     await send_delete_page(update.effective_chat.id, context, page=0)
 
 # ================= ADMIN EDIT =================
@@ -1078,8 +3314,13 @@ async def delete_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def edit_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin_update(update):
         await update.message.reply_text("⛔ فقط ادمین")
-        return
+        return ConversationHandler.END
+    query_text = " ".join(context.args)
+    set_admin_filter(context, "edit", "q" if query_text else "a", query_text)
     await send_edit_page(update.effective_chat.id, context, page=0)
+    return EDIT_BROWSE
+
+EDIT_CALLBACK_PATTERN = r"^(admin_edit_page:|admin_edit_filter:|edit_item:|edit_field:title:|edit_field:poster:|edit_field:moviefile:|edit_field:seriesfile:|edit_series_season:)"
 
 async def edit_callback_entry(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -1095,33 +3336,46 @@ async def edit_callback_entry(update: Update, context: ContextTypes.DEFAULT_TYPE
     if data.startswith("admin_edit_page:"):
         _, page = data.split(":", 1)
         await send_edit_page(query.message.chat_id, context, int(page))
-        return EDIT_WAIT_TITLE
+        return EDIT_BROWSE
+
+    if data.startswith("admin_edit_filter:"):
+        _, token = data.split(":", 1)
+        if token == "cats":
+            await send_admin_category_filters(query.message.chat_id, context, "admin_edit_filter")
+            return EDIT_BROWSE
+        if is_category_token(token) and admin_filter_category(token) is None:
+            await query.message.reply_text("❌ دسته‌بندی پیدا نشد")
+            return EDIT_BROWSE
+        set_admin_filter(context, "edit", token)
+        await send_edit_page(query.message.chat_id, context, 0)
+        return EDIT_BROWSE
 
     if data.startswith("edit_item:"):
         _, item_id, page = data.split(":", 2)
         item = db["items"].get(item_id)
         if not item:
             await query.message.reply_text("❌ آیتم پیدا نشد")
-            return EDIT_WAIT_TITLE
+            return EDIT_BROWSE
 
         context.user_data["edit_data"] = {"item_id": item_id, "page": int(page)}
         await send_edit_fields(query.message.chat_id, item, int(page), context)
-        return EDIT_WAIT_TITLE
+        return EDIT_BROWSE
 
     if data.startswith("edit_field:title:"):
-        _, _, _, item_id, page = data.split(":", 4)
-        context.user_data["edit_data"] = {"item_id": item_id, "page": int(page)}
+        _, _, item_id, page = data.split(":", 3)
+        # Title text is only taken after this button, never while browsing.
+        context.user_data["edit_data"] = {"item_id": item_id, "page": int(page), "field": "title"}
         await query.message.reply_text("عنوان جدید را بفرست:", reply_markup=kb_cancel())
         return EDIT_WAIT_TITLE
 
     if data.startswith("edit_field:poster:"):
-        _, _, _, item_id, page = data.split(":", 4)
+        _, _, item_id, page = data.split(":", 3)
         context.user_data["edit_data"] = {"item_id": item_id, "page": int(page)}
         await query.message.reply_text("پوستر جدید را بفرست یا /skip برای حذف پوستر:", reply_markup=kb_cancel())
         return EDIT_WAIT_POSTER
 
     if data.startswith("edit_field:moviefile:"):
-        _, _, _, item_id, page = data.split(":", 4)
+        _, _, item_id, page = data.split(":", 3)
         context.user_data["edit_data"] = {"item_id": item_id, "page": int(page)}
         await query.message.reply_text(
             "فایل جدید فیلم را از کانال آرشیو فوروارد کن یا message_id آن را بفرست:",
@@ -1130,7 +3384,7 @@ async def edit_callback_entry(update: Update, context: ContextTypes.DEFAULT_TYPE
         return EDIT_WAIT_MOVIE_FILE
 
     if data.startswith("edit_field:seriesfile:"):
-        _, _, _, item_id, page = data.split(":", 4)
+        _, _, item_id, page = data.split(":", 3)
         item = db["items"].get(item_id)
         if not item:
             await query.message.reply_text("❌ سریال پیدا نشد")
@@ -1162,7 +3416,7 @@ async def edit_callback_entry(update: Update, context: ContextTypes.DEFAULT_TYPE
         )
         return EDIT_WAIT_SERIES_EPISODE_COUNT
 
-    return EDIT_WAIT_TITLE
+    return EDIT_BROWSE
 
 async def edit_title_wait(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = update.message.text.strip()
@@ -1173,18 +3427,14 @@ async def edit_title_wait(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     edit_data = context.user_data.get("edit_data", {})
     item_id = edit_data.get("item_id")
-    if not item_id:
+    if not item_id or edit_data.get("field") != "title":
         await update.message.reply_text("❌ آیتم مشخص نیست", reply_markup=kb_main())
         return ConversationHandler.END
 
-    db = load_db()
-    item = db["items"].get(item_id)
-    if not item:
+    if not await mutate_item(item_id, lambda db, item: item.update(title=text)):
         await update.message.reply_text("❌ آیتم پیدا نشد", reply_markup=kb_main())
         return ConversationHandler.END
 
-    item["title"] = text
-    save_db(db)
     await update.message.reply_text("✅ عنوان ویرایش شد", reply_markup=kb_main())
     context.user_data.pop("edit_data", None)
     return ConversationHandler.END
@@ -1202,19 +3452,16 @@ async def edit_poster_wait(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ آیتم مشخص نیست", reply_markup=kb_main())
         return ConversationHandler.END
 
-    db = load_db()
-    item = db["items"].get(item_id)
-    if not item:
-        await update.message.reply_text("❌ آیتم پیدا نشد", reply_markup=kb_main())
-        return ConversationHandler.END
-
-    if update.message.photo:
-        item["poster_file_id"] = update.message.photo[-1].file_id
-    else:
+    if not update.message.photo:
         await update.message.reply_text("فقط عکس بفرست یا /skip بزن")
         return EDIT_WAIT_POSTER
 
-    save_db(db)
+    photo = update.message.photo[-1]
+    poster = {"poster_file_id": photo.file_id, "poster_meta": poster_meta_from_photo(photo)}
+    if not await mutate_item(item_id, lambda db, item: item.update(poster)):
+        await update.message.reply_text("❌ آیتم پیدا نشد", reply_markup=kb_main())
+        return ConversationHandler.END
+
     await update.message.reply_text("✅ پوستر ویرایش شد", reply_markup=kb_main())
     context.user_data.pop("edit_data", None)
     return ConversationHandler.END
@@ -1222,14 +3469,10 @@ async def edit_poster_wait(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def edit_skip_poster(update: Update, context: ContextTypes.DEFAULT_TYPE):
     edit_data = context.user_data.get("edit_data", {})
     item_id = edit_data.get("item_id")
-    db = load_db()
-    item = db["items"].get(item_id)
-    if not item:
+    if not await mutate_item(item_id, lambda db, item: item.update(poster_file_id=None, poster_meta=None)):
         await update.message.reply_text("❌ آیتم پیدا نشد", reply_markup=kb_main())
         return ConversationHandler.END
 
-    item["poster_file_id"] = None
-    save_db(db)
     await update.message.reply_text("✅ پوستر حذف شد", reply_markup=kb_main())
     context.user_data.pop("edit_data", None)
     return ConversationHandler.END
@@ -1249,15 +3492,15 @@ async def edit_movie_file_wait(update: Update, context: ContextTypes.DEFAULT_TYP
     edit_data = context.user_data.get("edit_data", {})
     item_id = edit_data.get("item_id")
 
-    db = load_db()
-    item = db["items"].get(item_id)
-    if not item:
+    def change(db, item):
+        item["archive_message_id"] = archive_message_id
+        feed_push(db, item_id, release_time(item))
+        sync_latest_item(db)
+
+    if not await mutate_item(item_id, change):
         await update.message.reply_text("❌ آیتم پیدا نشد", reply_markup=kb_main())
         return ConversationHandler.END
 
-    item["archive_message_id"] = archive_message_id
-    save_db(db)
-
     await update.message.reply_text("✅ فایل فیلم ویرایش شد", reply_markup=kb_main())
     context.user_data.pop("edit_data", None)
     return ConversationHandler.END
@@ -1314,42 +3557,1597 @@ async def edit_series_episode_file_wait(update: Update, context: ContextTypes.DE
         )
         return EDIT_WAIT_SERIES_EPISODE_FILE
 
-    db = load_db()
-    item = db["items"].get(item_id)
-    if not item:
+    def change(db, item):
+        # The slot is only used up once the series is known to exist.
+        publish_at = edit_data["publish_at"] = take_publish_slot(context)
+        release_at = release_time(item, publish_at)
+        item.setdefault("seasons", {})
+        old_episodes = item["seasons"].get(str(season_num), {})
+        item["seasons"][str(season_num)] = edit_data["new_episode_map"]
+        schedule_season(item, str(season_num), old_episodes, release_at)
+        feed_push(db, item_id, release_at)
+        sync_latest_item(db)
+        announce(db, item, str(season_num), release_at)
+
+    if not await mutate_item(item_id, change):
         await update.message.reply_text("❌ سریال پیدا نشد", reply_markup=kb_main())
         return ConversationHandler.END
 
-    item.setdefault("seasons", {})
-    item["seasons"][str(season_num)] = edit_data["new_episode_map"]
-    save_db(db)
-
-    await update.message.reply_text("✅ فصل سریال ویرایش شد", reply_markup=kb_main())
+    await update.message.reply_text("✅ فصل سریال ویرایش شد" + publish_note(edit_data["publish_at"]), reply_markup=kb_main())
     context.user_data.pop("edit_data", None)
     return ConversationHandler.END
 
+# ================= ADMIN CATEGORIES =================
+
+CATEGORY_HELP = (
+    "مدیریت دسته‌بندی‌ها:\n"
+    "/cat — فهرست\n"
+    "/cat add نام\n"
+    "/cat rename قدیم | جدید\n"
+    "/cat merge مبدا | مقصد\n"
+    "/cat move نام | جایگاه"
+)
+
+def category_list_text(db: dict):
+    lines = ["📂 دسته‌بندی‌ها:"]
+    for position, category in enumerate(db["categories"], start=1):
+        lines.append(f"{position}. {category['name']} ({category['count']})")
+    return "\n".join(lines)
+
+async def category_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin_update(update):
+        await update.message.reply_text("⛔ فقط ادمین")
+        return
+
+    text = update.message.text.split(maxsplit=2)
+    action = text[1] if len(text) > 1 else ""
+    args = [a.strip() for a in text[2].split("|")] if len(text) > 2 else []
+
+    if not action:
+        await update.message.reply_text(category_list_text(load_db()) + "\n\n" + CATEGORY_HELP)
+        return
+
+    replies = []
+
+    def change(db):
+        reply, changed = apply_category_action(db, action, args)
+        replies.append(reply)
+        return changed
+
+    if not await mutate_catalog(change):
+        await update.message.reply_text(replies[0])
+        return
+    await update.message.reply_text(replies[0] + "\n\n" + category_list_text(load_db()), reply_markup=kb_main())
+
+def apply_category_action(db: dict, action: str, args: list):
+    # Returns (reply, whether the catalog changed).
+    if action == "add" and len(args) == 1:
+        error = category_name_error(db, args[0])
+        if error:
+            return f"❌ {error}", False
+        db["categories"].append({"name": args[0], "count": 0})
+        db["category_renames"].pop(args[0], None)
+        return f"✅ دسته‌بندی «{args[0]}» اضافه شد", True
+
+    if action == "rename" and len(args) == 2:
+        old, new = args
+        if not find_category(db, old):
+            return f"❌ دسته‌بندی «{old}» پیدا نشد", False
+        error = category_name_error(db, new)
+        if error:
+            return f"❌ {error}", False
+        moved = rename_category(db, old, new)
+        return f"✅ «{old}» به «{new}» تغییر کرد ({moved} آیتم)", True
+
+    if action == "merge" and len(args) == 2:
+        source, target = args
+        if not find_category(db, source) or not find_category(db, target) or source == target:
+            return "❌ دو دسته‌بندی موجود و متفاوت لازم است", False
+        moved = merge_category(db, source, target)
+        return f"✅ «{source}» در «{target}» ادغام شد ({moved} آیتم)", True
+
+    if action == "move" and len(args) == 2 and args[1].isdigit():
+        if not find_category(db, args[0]):
+            return f"❌ دسته‌بندی «{args[0]}» پیدا نشد", False
+        position = move_category(db, args[0], int(args[1]))
+        return f"✅ «{args[0]}» به جایگاه {position} رفت", True
+
+    return CATEGORY_HELP, False
+
+# ================= ADMIN IMPORT / EXPORT =================
+
+def iter_catalog_jsonl(db: dict):
+    for item in db["items"].values():
+        yield json.dumps(item, ensure_ascii=False) + "\n"
+
+def is_timestamp(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def validate_import_record(record, known_ids: set):
+    if not isinstance(record, dict):
+        return None, "رکورد باید یک شیء JSON باشد"
+
+    title = str(record.get("title") or "").strip()
+    if not title:
+        return None, "عنوان خالی است"
+    if record.get("kind") not in ("movie", "series"):
+        return None, "kind باید movie یا series باشد"
+    if record.get("category") not in INDEX["category_names"]:
+        return None, f"دسته‌بندی نامعتبر: {record.get('category')}"
+
+    item = dict(record)
+    item.pop("handle", None)
+    item["title"] = title
+    item["id"] = str(record.get("id") or make_item_id(title))
+    if not ITEM_ID_RE.fullmatch(item["id"]):
+        return None, f"شناسه نامعتبر: {item['id'][:40]}"
+    item.setdefault("poster_file_id", None)
+    item.setdefault("created_at", int(time.time()))
+
+    for field in ("created_at", "publish_at"):
+        if field in item and not is_timestamp(item[field]):
+            return None, f"{field} باید عدد صحیح باشد"
+    if item["poster_file_id"] is not None and not isinstance(item["poster_file_id"], str):
+        return None, "poster_file_id نامعتبر"
+    if item.get("poster_meta") is not None and not isinstance(item["poster_meta"], dict):
+        return None, "poster_meta نامعتبر"
+
+    if item["kind"] == "movie":
+        if not valid_file_value(item.get("archive_message_id")):
+            return None, "archive_message_id نامعتبر"
+    else:
+        seasons = item.get("seasons")
+        if not isinstance(seasons, dict) or not seasons:
+            return None, "seasons خالی یا نامعتبر"
+        for episodes in seasons.values():
+            if not isinstance(episodes, dict) or not episodes:
+                return None, "فصل بدون قسمت"
+            if not all(valid_file_value(m) for m in episodes.values()):
+                return None, "شناسه پیام قسمت نامعتبر"
+        item["seasons"] = {
+            str(season_num): {str(episode_num): value for episode_num, value in episodes.items()}
+            for season_num, episodes in seasons.items()
+        }
+
+    if "episode_publish_at" in item:
+        schedule = item["episode_publish_at"]
+        if not isinstance(schedule, dict) or not all(
+            isinstance(episodes, dict) and all(is_timestamp(ts) for ts in episodes.values())
+            for episodes in schedule.values()
+        ):
+            return None, "episode_publish_at نامعتبر"
+        item["episode_publish_at"] = {
+            str(season_num): {str(episode_num): ts for episode_num, ts in episodes.items()}
+            for season_num, episodes in schedule.items()
+        }
+
+    # Without any archive history there is nothing to check against.
+    if known_ids:
+        missing = [m for m in item_archive_message_ids(item) if archive_ref(m) not in known_ids]
+        if missing:
+            return None, f"پیام در آرشیو پیدا نشد: {missing[0]}"
+
+    return item, None
+
+def apply_import(db: dict, records: dict):
+    added = updated = 0
+    for item_id, item in records.items():
+        if item_id in db["items"]:
+            updated += 1
+            item["handle"] = db["items"][item_id].get("handle")
+            count_category(db, db["items"][item_id]["category"], -1)
+        else:
+            added += 1
+            assign_handle(db, item)
+            feed_push(db, item_id, item["created_at"])
+        count_category(db, item["category"], 1)
+        db["items"][item_id] = item
+    sync_latest_item(db)
+    return added, updated
+
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin_update(update):
+        await update.message.reply_text("⛔ فقط ادمین")
+        return
+
+    db = load_db()
+    fd, path = tempfile.mkstemp(suffix=".jsonl")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.writelines(iter_catalog_jsonl(db))
+        with open(path, "rb") as f:
+            await update.message.reply_document(
+                document=f,
+                filename=time.strftime("catalog-%Y%m%d-%H%M.jsonl"),
+                caption=f"📦 {len(db['items'])} آیتم",
+            )
+    finally:
+        os.remove(path)
+
+async def import_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin_update(update):
+        await update.message.reply_text("⛔ فقط ادمین")
+        return ConversationHandler.END
+
+    await update.message.reply_text(
+        "فایل JSONL را بفرست (هر خط یک آیتم):",
+        reply_markup=kb_cancel()
+    )
+    return IMPORT_WAIT_FILE
+
+async def import_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if (update.message.text or "").strip() == BACK_BTN:
+        await update.message.reply_text("🏠 منوی اصلی", reply_markup=kb_main())
+        return ConversationHandler.END
+
+    document = update.message.document
+    if not document:
+        await update.message.reply_text("فقط فایل .jsonl بفرست یا /cancel بزن")
+        return IMPORT_WAIT_FILE
+
+    status = await update.message.reply_text("⏳ در حال دریافت فایل...")
+    fd, path = tempfile.mkstemp(suffix=".jsonl")
+    os.close(fd)
+
+    added = updated = 0
+    errors = []
+    line_no = 0
+    failure = None
+    try:
+        file = await document.get_file()
+        await file.download_to_drive(path)
+
+        known_ids = INDEX["archive_ids"]
+        staged = {}
+
+        with open(path, "r", encoding="utf-8") as f:
+            for line_no, line in enumerate(f, start=1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    item, error = validate_import_record(json.loads(line), known_ids)
+                except ValueError:
+                    item, error = None, "JSON نامعتبر"
+                if error:
+                    errors.append(f"خط {line_no}: {error}")
+                    continue
+
+                staged[item["id"]] = item
+                if line_no % IMPORT_BATCH == 0:
+                    await status.edit_text(f"⏳ {line_no} خط بررسی شد\n✅ {len(staged)} معتبر | ❌ {len(errors)} خطا")
+
+        if staged:
+            # One change for the whole file: records replace items whole, so
+            # the catalog's own items are shared, not copied.
+            added, updated = await mutate_catalog(
+                lambda db: apply_import(db, staged), staged, copy_items=False
+            )
+        await flush_catalog()
+    except Exception as e:
+        # Nothing is published unless it applied and indexed cleanly, so the
+        # catalog is as it was; say so instead of leaving the status hanging.
+        log.exception("Import failed")
+        failure = f"{type(e).__name__}: {e}"
+    finally:
+        os.remove(path)
+
+    if failure:
+        text = f"❌ ورود اطلاعات انجام نشد و کاتالوگ تغییری نکرد ({line_no} خط)\n{failure[:300]}"
+    else:
+        text = f"✅ ورود اطلاعات تمام شد ({line_no} خط)\n➕ {added} جدید | ✏️ {updated} به‌روزرسانی | ❌ {len(errors)} خطا"
+    if errors:
+        text += "\n\n" + "\n".join(errors[:10])
+    await status.edit_text(text)
+    await update.message.reply_text("🏠 منوی اصلی", reply_markup=kb_main())
+    return ConversationHandler.END
+
+# ================= BROADCAST =================
+
+# Announcements live in the catalog (written by the catalog writer); each
+# worker fans them out to its own subscribers and keeps its progress on disk.
+BROADCAST = {"state": None, "renames_seen": None}
+
+def announce(db: dict, item: dict, season_num: str = None, publish_at: int = None):
+    db["announce_seq"] += 1
+    ann = {
+        "id": db["announce_seq"],
+        "item_id": item["id"],
+        "category": item["category"],
+        "season": season_num,
+        "created_at": int(time.time()),
+    }
+    if publish_at:
+        # Scheduled releases are announced when they go up, not when added.
+        ann["not_before"] = publish_at
+    db["announcements"].append(ann)
+    del db["announcements"][:-ANNOUNCEMENTS_KEEP]
+
+def load_broadcast_state():
+    if BROADCAST["state"] is not None:
+        return BROADCAST["state"]
+
+    path = state_path("broadcast")
+    fresh = not os.path.exists(path)
+    data = read_json(path, {})
+    state = {
+        "subs": data.get("subs", {}),
+        "blocked": set(data.get("blocked", [])),
+        "progress": data.get("progress", {}),
+        "done": set(data.get("done", [])),
+    }
+    if fresh:
+        # A new worker must not replay announcements made before it existed.
+        state["done"].update(a["id"] for a in load_db()["announcements"])
+    BROADCAST["state"] = state
+    follow_category_renames(state)
+    return state
+
+def follow_category_renames(state: dict):
+    db = load_db()
+    if BROADCAST.get("renames_seen") == db["category_renames_seq"]:
+        return
+    BROADCAST["renames_seen"] = db["category_renames_seq"]
+    changed = False
+    for sub in state["subs"].values():
+        resolved = list(dict.fromkeys(resolve_category(db, c) for c in sub["categories"]))
+        if resolved != sub["categories"]:
+            sub["categories"] = resolved
+            changed = True
+    if changed:
+        save_broadcast_state()
+
+def save_broadcast_state():
+    state = BROADCAST["state"]
+    if state is None:
+        return
+    live = {a["id"] for a in load_db()["announcements"]}
+    state["done"] &= live
+    write_json_atomic(state_path("broadcast"), {
+        "subs": state["subs"],
+        "blocked": sorted(state["blocked"]),
+        "progress": state["progress"],
+        "done": sorted(state["done"]),
+    })
+
+def toggle_subscription(user_id: int, field: str, value: str):
+    state = load_broadcast_state()
+    sub = state["subs"].setdefault(str(user_id), {"categories": [], "items": []})
+    values = sub[field]
+    if value in values:
+        values.remove(value)
+        subscribed = False
+    else:
+        values.append(value)
+        subscribed = True
+        state["blocked"].discard(user_id)
+    if not sub["categories"] and not sub["items"]:
+        del state["subs"][str(user_id)]
+    save_broadcast_state()
+    return subscribed
+
+def announcement_recipients(ann: dict, state: dict, after_user_id: int):
+    recipients = []
+    for uid, sub in state["subs"].items():
+        uid = int(uid)
+        if uid <= after_user_id or uid in state["blocked"]:
+            continue
+        if ann["category"] in sub["categories"] or ann["item_id"] in sub["items"]:
+            recipients.append(uid)
+    return sorted(recipients)
+
+def announcement_message(item: dict, ann: dict):
+    text = f"🆕 {item['title']}\n📂 {item['category']}"
+    if ann.get("season"):
+        text += f"\nفصل {ann['season']} اضافه شد"
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("🎬 مشاهده", callback_data=f"item:{item['id']}:{item['category']}:0")]
+    ])
+    return text, keyboard
+
+async def send_announcement(bot, ann: dict, state: dict):
+    key = str(ann["id"])
+    item = load_db()["items"].get(ann["item_id"])
+    if item:
+        text, keyboard = announcement_message(item, ann)
+        sent = 0
+        for uid in announcement_recipients(ann, state, state["progress"].get(key, 0)):
+            if is_overloaded():
+                # Deferred: progress is kept and the fan-out resumes when calm.
+                save_broadcast_state()
+                return
+            try:
+                await outbound_send(
+                    lambda uid=uid: bot.send_message(chat_id=uid, text=text, reply_markup=keyboard),
+                    priority=PRIORITY_LOW,
+                )
+                sent += 1
+            except Forbidden:
+                # Blocked the bot: never retried, dropped from future fan-outs.
+                state["blocked"].add(uid)
+            except BadRequest as e:
+                if "chat not found" in str(e).lower():
+                    state["blocked"].add(uid)
+                else:
+                    log.warning("Announcement %s to %s failed: %s", key, uid, e)
+            except TelegramError as e:
+                log.warning("Announcement %s to %s failed: %s", key, uid, e)
+            state["progress"][key] = uid
+            if sent and sent % BROADCAST_SAVE_EVERY == 0:
+                save_broadcast_state()
+        log.info("Announcement %s delivered to %s subscribers", key, sent)
+
+    state["done"].add(ann["id"])
+    state["progress"].pop(key, None)
+    save_broadcast_state()
+
+async def run_pending_broadcasts(bot):
+    state = load_broadcast_state()
+    follow_category_renames(state)
+    now = time.time()
+    for ann in list(load_db()["announcements"]):
+        if ann["id"] in state["done"]:
+            continue
+        if "not_before" in ann and ann["not_before"] + PUBLISH_CHECK_INTERVAL > now:
+            # One release check later, so every worker shows the item by then.
+            continue
+        if now - max(ann["created_at"], ann.get("not_before", 0)) > BROADCAST_MAX_AGE:
+            state["done"].add(ann["id"])
+            continue
+        await send_announcement(bot, ann, state)
+
+async def broadcast_loop(bot):
+    while True:
+        await asyncio.sleep(BROADCAST_POLL)
+        if is_overloaded():
+            continue
+        try:
+            await run_pending_broadcasts(bot)
+        except Exception as e:
+            log.exception(e)
+
+async def subs_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await ensure_joined(update, context):
+        return
+
+    sub = load_broadcast_state()["subs"].get(str(update.effective_user.id))
+    if not sub:
+        await update.message.reply_text("🔕 هیچ اطلاع‌رسانی فعالی نداری")
+        return
+
+    db = load_db()
+    rows = []
+    for category in sub["categories"]:
+        rows.append([InlineKeyboardButton(f"❌ {category}", callback_data=f"sub_cat:{category}")])
+    for item_id in sub["items"]:
+        title = db["items"].get(item_id, {}).get("title", item_id)
+        rows.append([InlineKeyboardButton(f"❌ {title}", callback_data=f"sub_item:{item_id}")])
+
+    await update.message.reply_text(
+        "🔔 اطلاع‌رسانی‌های فعال (برای لغو بزن):",
+        reply_markup=InlineKeyboardMarkup(rows)
+    )
+
+# ================= SCHEDULED PUBLISHING =================
+
+# /schedule sets a publish time for the admin's next additions and season
+# edits; each one takes the next slot, `step` seconds after the previous, so a
+# batch of heavy releases (and their announcements) is spread over the day.
+# Nothing is written when a release goes up: every worker's publish_loop()
+# adds due items to its own indexes.
+
+DURATION_RE = re.compile(r"^\+(\d+)([mhd])$")
+DURATION_UNITS = {"m": 60, "h": 3600, "d": 86400}
+
+def schedule_timezone():
+    if SCHEDULE_UTC_OFFSET:
+        return timezone(timedelta(minutes=int(SCHEDULE_UTC_OFFSET)))
+    return None
+
+def format_publish_time(ts: int):
+    return datetime.fromtimestamp(ts, schedule_timezone()).strftime("%Y-%m-%d %H:%M")
+
+def parse_duration(text: str):
+    match = DURATION_RE.match(text)
+    return int(match[1]) * DURATION_UNITS[match[2]] if match else None
+
+def parse_publish_time(args: list):
+    # "+2h", "21:30" (its next occurrence) or "2026-10-20 21:30".
+    text = " ".join(args)
+    offset = parse_duration(text)
+    if offset is not None:
+        return int(time.time()) + offset
+    tz = schedule_timezone()
+    now = datetime.now(tz)
+    try:
+        if len(args) == 1:
+            clock = datetime.strptime(text, "%H:%M")
+            when = now.replace(hour=clock.hour, minute=clock.minute, second=0, microsecond=0)
+            if when <= now:
+                when += timedelta(days=1)
+        else:
+            when = datetime.strptime(text, "%Y-%m-%d %H:%M").replace(tzinfo=tz)
+    except ValueError:
+        return None
+    return int(when.timestamp())
+
+def take_publish_slot(context: ContextTypes.DEFAULT_TYPE):
+    plan = context.user_data.get("publish_plan")
+    if not plan:
+        return None
+    publish_at = plan["at"]
+    plan["at"] += plan["step"]
+    return publish_at if publish_at > time.time() else None
+
+def release_time(item: dict, publish_at: int = None):
+    # When a change to `item` goes up: its slot, or the item's own if later.
+    ts = max(publish_at or 0, item.get("publish_at", 0))
+    return ts if ts > time.time() else None
+
+def apply_publish_slot(context: ContextTypes.DEFAULT_TYPE, item: dict):
+    # Called inside the catalog change, so a failed change keeps the slot.
+    publish_at = take_publish_slot(context)
+    if publish_at:
+        item["created_at"] = publish_at
+        item["publish_at"] = publish_at
+    return item
+
+def publish_note(publish_at: int):
+    return f"\n⏰ انتشار: {format_publish_time(publish_at)}" if publish_at else ""
+
+def schedule_season(item: dict, season_num: str, old_episodes: dict, publish_at: int = None):
+    # Only new or replaced episodes wait; the ones users already have stay up.
+    episodes = item["seasons"][season_num]
+    pending = {
+        episode_num: ts
+        for episode_num, ts in item.get("episode_publish_at", {}).get(season_num, {}).items()
+        if ts > time.time() and old_episodes.get(episode_num) == episodes.get(episode_num)
+    }
+    if publish_at:
+        for episode_num, value in episodes.items():
+            if old_episodes.get(episode_num) != value:
+                pending[episode_num] = publish_at
+    schedule = item.setdefault("episode_publish_at", {})
+    if pending:
+        schedule[season_num] = pending
+    else:
+        schedule.pop(season_num, None)
+    if not schedule:
+        item.pop("episode_publish_at", None)
+
+def publish_now(db: dict, item: dict):
+    if "publish_at" not in item and "episode_publish_at" not in item:
+        return False
+    now = int(time.time())
+    if item.pop("publish_at", None) is not None:
+        item["created_at"] = now
+    item.pop("episode_publish_at", None)
+    feed_push(db, item["id"], now)
+    sync_latest_item(db)
+    for ann in db["announcements"]:
+        if ann["item_id"] == item["id"] and ann.get("not_before", 0) > now:
+            ann["not_before"] = now
+    return True
+
+def release_due():
+    db = load_db()
+    now = time.time()
+    pending = INDEX["schedule"]
+    count = 0
+    while count < len(pending) and pending[count][0] <= now:
+        count += 1
+    if not count:
+        return 0
+
+    due, INDEX["schedule"] = pending[:count], pending[count:]
+    SCHEDULE["clock"] = now
+    SCHEDULE["epoch"] += 1
+    released = [
+        db["items"][item_id]
+        for _, item_id, season_num, _ in due
+        if season_num is None and item_id in db["items"]
+    ]
+    for item in released:
+        index_released_item(db, item)
+    if released:
+        # Ranks are positions in INDEX["recent"], which just shifted.
+        INDEX["rank"] = {item_id: rank for rank, item_id in enumerate(INDEX["recent"])}
+        INDEX["admin"]["scheduled"] = [i for i in INDEX["admin"]["scheduled"] if not is_released(db["items"][i])]
+    for category in INDEX["by_category"]:
+        category_page_response(db, category, 0)
+    # Pinned overviews of hot titles bypass the response cache; rebuild them.
+    for item_id in {entry[1] for entry in due} & HOT_DELIVERIES:
+        if item_id in db["items"]:
+            pin_item(db["items"][item_id])
+    log.info("Released %s scheduled items and %s episodes", len(released), count - len(released))
+    return count
+
+async def publish_loop():
+    while True:
+        await asyncio.sleep(PUBLISH_CHECK_INTERVAL)
+        release_due()
+
+def schedule_status_text(context: ContextTypes.DEFAULT_TYPE, db: dict):
+    plan = context.user_data.get("publish_plan")
+    if plan:
+        lines = [f"⏰ افزودنی بعدی: {format_publish_time(plan['at'])}"]
+        if plan["step"]:
+            lines[0] += f" (فاصله {plan['step'] // 60} دقیقه)"
+    else:
+        lines = ["⏰ افزودنی‌ها فوری منتشر می‌شوند"]
+
+    pending = INDEX["schedule"]
+    if not pending:
+        lines.append("\nصف انتشار خالی است")
+    else:
+        lines.append(f"\nصف انتشار ({len(pending)}):")
+        for publish_at, item_id, season_num, episode_num in pending[:SCHEDULE_LIST_LIMIT]:
+            item = db["items"].get(item_id)
+            if not item:
+                continue
+            line = f"{format_publish_time(publish_at)} | {item['title']} (#{item['handle']})"
+            if season_num is not None:
+                line += f" | فصل {season_num} قسمت {episode_num}"
+            lines.append(line)
+
+    lines.append(
+        "\n/schedule 21:30 یا /schedule +2h یا /schedule 2026-10-20 21:30\n"
+        "با فاصله بین افزودنی‌ها: /schedule 21:30 +30m\n"
+        "/schedule now <handle> انتشار فوری\n"
+        "/schedule off خاموش"
+    )
+    return "\n".join(lines)
+
+async def schedule_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin_update(update):
+        await update.message.reply_text("⛔ فقط ادمین می‌تواند استفاده کند")
+        return
+
+    args = context.args
+    db = load_db()
+
+    if not args:
+        await update.message.reply_text(schedule_status_text(context, db))
+        return
+
+    if args[0] == "off":
+        context.user_data.pop("publish_plan", None)
+        await update.message.reply_text("✅ زمان‌بندی خاموش شد؛ افزودنی‌های بعدی فوری منتشر می‌شوند")
+        return
+
+    if args[0] == "now":
+        item_id = INDEX["handles"].get(args[1].lstrip("#")) if len(args) > 1 else None
+        if not item_id:
+            await update.message.reply_text("❌ آیتم پیدا نشد\nمثال: /schedule now 1a")
+            return
+
+        def change(db):
+            item = db["items"].get(item_id)
+            return bool(item) and publish_now(db, item)
+
+        if not await mutate_catalog(change, [item_id]):
+            await update.message.reply_text("❌ این آیتم در صف انتشار نیست")
+            return
+        await update.message.reply_text("✅ منتشر شد")
+        return
+
+    step = 0
+    if len(args) > 1 and parse_duration(args[-1]) is not None:
+        step = parse_duration(args[-1])
+        args = args[:-1]
+    publish_at = parse_publish_time(args)
+    if publish_at is None or publish_at <= time.time():
+        await update.message.reply_text("❌ زمان نامعتبر است\n\n" + schedule_status_text(context, db))
+        return
+
+    context.user_data["publish_plan"] = {"at": publish_at, "step": step}
+    text = f"✅ افزودنی‌ها و ویرایش فصل‌های بعدی در {format_publish_time(publish_at)} منتشر می‌شوند"
+    if step:
+        text += f"\nهر مورد {step // 60} دقیقه بعد از قبلی"
+    await update.message.reply_text(text)
+
+# ================= AUDIT =================
+
+# The catalog writer walks the catalog a few items at a time, checks that
+# every movie/episode reference is well formed and that the archive message
+# still exists, and keeps what it found in audit.json for /audit.
+AUDIT = {"report": None, "next_call": 0.0}
+
+def load_audit_report():
+    if AUDIT["report"] is None:
+        AUDIT["report"] = read_json(AUDIT_PATH, {})
+        for key, value in {"cursor": None, "passes": 0, "pass_started": None, "last_pass": None, "broken": {}}.items():
+            AUDIT["report"].setdefault(key, value)
+    return AUDIT["report"]
+
+def save_audit_report():
+    write_json_atomic(AUDIT_PATH, AUDIT["report"], indent=2)
+
+def audit_references(item: dict):
+    # Returns (problems found without the API, references still to probe).
+    problems = []
+    refs = []
+
+    def check(season_num, episode_num, value):
+        for msg_id in file_variants(value) or [value]:
+            source = archive_ref(msg_id)
+            if source is not None:
+                refs.append((season_num, episode_num, msg_id, source))
+            else:
+                problems.append({"season": season_num, "episode": episode_num, "message_id": msg_id, "problem": "invalid"})
+
+    if item.get("kind") == "movie":
+        check(None, None, item.get("archive_message_id"))
+        return problems, refs
+
+    seasons = item.get("seasons")
+    if not isinstance(seasons, dict) or not seasons:
+        problems.append({"season": None, "episode": None, "message_id": None, "problem": "empty"})
+        return problems, refs
+    for season_num, episodes in seasons.items():
+        if not isinstance(episodes, dict) or not episodes:
+            problems.append({"season": season_num, "episode": None, "message_id": None, "problem": "empty"})
+            continue
+        for episode_num, msg_id in episodes.items():
+            check(season_num, episode_num, msg_id)
+    return problems, refs
+
+async def audit_call(send):
+    # Strict pacing of its own on top of the outbound queue, at the lowest priority.
+    loop = asyncio.get_running_loop()
+    now = loop.time()
+    slot = max(now, AUDIT["next_call"])
+    AUDIT["next_call"] = slot + 60 / AUDIT_CALLS_PER_MINUTE
+    if slot > now:
+        await asyncio.sleep(slot - now)
+    return await outbound_send(send, priority=PRIORITY_LOW)
+
+async def probe_archive_ids(bot, source_chat: int, msg_ids: list):
+    # copyMessages silently skips messages that no longer exist, so a short
+    # answer means something in the batch is gone; split until it is found.
+    if len(msg_ids) > COPY_MESSAGES_LIMIT:
+        gone = set()
+        for i in range(0, len(msg_ids), COPY_MESSAGES_LIMIT):
+            gone |= await probe_archive_ids(bot, source_chat, msg_ids[i:i + COPY_MESSAGES_LIMIT])
+        return gone
+
+    chat_id = AUDIT_CHAT_ID
+    try:
+        copies = await audit_call(lambda: bot.copy_messages(
+            chat_id=chat_id,
+            from_chat_id=source_chat,
+            message_ids=msg_ids,
+            disable_notification=True,
+        ))
+    except (Forbidden, BadRequest) as e:
+        text = str(e).lower()
+        if isinstance(e, Forbidden) or any(marker in text for marker in ("chat not found", "channel_private", "rights")):
+            # A chat we cannot use says nothing about the messages: fail the step.
+            raise
+        if len(msg_ids) == 1:
+            return set(msg_ids)
+        # Something in the batch was rejected; split to find it.
+        copies = None
+    if copies:
+        try:
+            await audit_call(lambda: bot.delete_messages(
+                chat_id=chat_id,
+                message_ids=[c.message_id for c in copies],
+            ))
+        except TelegramError as e:
+            log.warning("Audit probe cleanup failed: %s", e)
+
+    if copies is not None:
+        if len(copies) == len(msg_ids):
+            return set()
+        if not copies or len(msg_ids) == 1:
+            return set(msg_ids)
+    middle = len(msg_ids) // 2
+    return (
+        await probe_archive_ids(bot, source_chat, msg_ids[:middle])
+        | await probe_archive_ids(bot, source_chat, msg_ids[middle:])
+    )
+
+async def audit_step(bot):
+    report = load_audit_report()
+    db = load_db()
+    ids = sorted(db["items"])
+    start = bisect.bisect_right(ids, report["cursor"]) if report["cursor"] else 0
+    if start >= len(ids):
+        if report["cursor"] is not None:
+            report["passes"] += 1
+            report["last_pass"] = int(time.time())
+        report["cursor"] = None
+        start = 0
+    if start == 0:
+        report["pass_started"] = int(time.time())
+
+    batch = []
+    probe = set()
+    for item_id in ids[start:]:
+        if batch and len(probe) >= AUDIT_BATCH:
+            break
+        problems, refs = audit_references(db["items"][item_id])
+        batch.append((item_id, db["items"][item_id]["title"], problems, refs))
+        probe.update(source for _, _, _, source in refs)
+
+    # Sources are probed as recorded; a file that only survives on a mirror
+    # still shows up here so the admin can re-point it.
+    missing = set()
+    by_chat = {}
+    for source_chat, msg_id in probe:
+        by_chat.setdefault(source_chat, []).append(msg_id)
+    for source_chat, msg_ids in by_chat.items() if AUDIT_CHAT_ID else ():
+        gone = await probe_archive_ids(bot, source_chat, sorted(msg_ids))
+        missing.update((source_chat, msg_id) for msg_id in gone)
+
+    now = int(time.time())
+    for item_id, title, problems, refs in batch:
+        problems += [
+            {"season": s, "episode": e, "message_id": msg_id, "problem": "missing"}
+            for s, e, msg_id, source in refs
+            if source in missing
+        ]
+        if not AUDIT_CHAT_ID:
+            # Nothing was probed; keep what failed deliveries already reported.
+            current = {(s, e, source) for s, e, _, source in refs}
+            problems += [
+                p for p in report["broken"].get(item_id, {}).get("problems", [])
+                if p["problem"] == "missing" and (p["season"], p["episode"], archive_ref(p["message_id"])) in current
+            ]
+        if problems:
+            report["broken"][item_id] = {"title": title, "problems": problems, "checked_at": now}
+        else:
+            report["broken"].pop(item_id, None)
+
+    live = load_db()["items"]
+    for item_id in [i for i in report["broken"] if i not in live]:
+        del report["broken"][item_id]
+    if batch:
+        report["cursor"] = batch[-1][0]
+    save_audit_report()
+
+def note_broken_reference(item_id: str, season_num, episode_num, msg_id):
+    # A delivery just failed; record it without waiting for the auditor to get there.
+    log.warning("Archive message %s of %s (%s/%s) not found", msg_id, item_id, season_num, episode_num)
+    if not is_catalog_writer():
+        return
+    item = load_db()["items"].get(item_id)
+    if not item:
+        return
+    report = load_audit_report()
+    entry = report["broken"].setdefault(item_id, {"title": item["title"], "problems": [], "checked_at": 0})
+    problem = {"season": season_num, "episode": episode_num, "message_id": msg_id, "problem": "missing"}
+    if problem not in entry["problems"]:
+        entry["problems"].append(problem)
+        entry["checked_at"] = int(time.time())
+        save_audit_report()
+
+async def audit_loop(bot):
+    while True:
+        await asyncio.sleep(AUDIT_INTERVAL)
+        if is_overloaded():
+            continue
+        try:
+            await audit_step(bot)
+        except TelegramError as e:
+            log.warning("Audit step failed: %s", e)
+        except Exception as e:
+            log.exception(e)
+
+def audit_problem_text(problem: dict):
+    labels = {"missing": "پیام آرشیو پیدا نشد", "invalid": "شناسه نامعتبر", "empty": "بدون قسمت"}
+    where = ""
+    if problem["season"] is not None:
+        where = f"فصل {problem['season']}"
+        if problem["episode"] is not None:
+            where += f" قسمت {problem['episode']}"
+        where += ": "
+    return f"{where}{labels[problem['problem']]}"
+
+async def audit_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin_update(update):
+        await update.message.reply_text("⛔ فقط ادمین")
+        return
+
+    report = load_audit_report()
+    broken = report.get("broken", {})
+    ids = sorted(load_db()["items"])
+    cursor = report.get("cursor")
+    done = bisect.bisect_right(ids, cursor) if cursor else 0
+
+    lines = [
+        "🩺 بررسی سلامت کاتالوگ",
+        f"پیشرفت دور جاری: {done} از {len(ids)}",
+        f"دورهای کامل: {report.get('passes', 0)}",
+    ]
+    if not AUDIT_CHAT_ID:
+        lines.append("ℹ️ بررسی وجود پیام‌ها خاموش است (AUDIT_CHAT_ID تنظیم نشده)")
+    if not broken:
+        lines.append("\n✅ مشکلی پیدا نشده")
+        await update.message.reply_text("\n".join(lines))
+        return
+
+    lines.append(f"\n⚠️ آیتم‌های خراب: {len(broken)}")
+    rows = []
+    for item_id, entry in sorted(broken.items(), key=lambda x: x[1]["title"])[:PAGE_SIZE * 2]:
+        lines.append(f"• {entry['title']}: " + "، ".join(audit_problem_text(p) for p in entry["problems"][:3]))
+        rows.append([InlineKeyboardButton(f"✏️ {entry['title']}", callback_data=f"edit_item:{item_id}:0")])
+
+    await update.message.reply_text("\n".join(lines), reply_markup=InlineKeyboardMarkup(rows))
+
 # ================= CHANNEL POST =================
 
+ARCHIVE_PENDING = {}
+MIRROR_PENDING = {}
+ARCHIVE_FLUSH = {"task": None}
+
+def archive_post_entry(msg):
+    meta = media_meta(msg)
+    entry = {"kind": "video" if msg.video else "document", "size": meta["s"]}
+    if "d" in meta:
+        entry["duration"] = meta["d"]
+    if meta["q"]:
+        entry["quality"] = meta["q"]
+    return entry
+
+async def flush_archive_posts_later():
+    # Uploads arrive in bursts; collect them so the catalog is written once.
+    await asyncio.sleep(ARCHIVE_FLUSH_DELAY)
+    flush_archive_posts()
+
+def flush_archive_posts():
+    ARCHIVE_FLUSH["task"] = None
+    if not ARCHIVE_PENDING and not MIRROR_PENDING:
+        return 0
+    flushed = len(ARCHIVE_PENDING) + len(MIRROR_PENDING)
+
+    def change(db):
+        # Both maps are shared with the published catalog: replace, don't edit.
+        db["archive_posts"] = {**db["archive_posts"], **ARCHIVE_PENDING}
+        mirrors = db["archive_mirrors"] = dict(db["archive_mirrors"])
+        for key, pending in MIRROR_PENDING.items():
+            known = mirrors.get(key, [])
+            mirrors[key] = known + [m for m in pending if m not in known]
+
+    change_catalog(change, ())
+    ARCHIVE_PENDING.clear()
+    MIRROR_PENDING.clear()
+    return flushed
+
+def mirror_origin(msg):
+    # A mirror post is a forward of an archive post; returns its post key.
+    origin = getattr(msg, "forward_origin", None)
+    chat = getattr(origin, "chat", None)
+    if chat is None or chat.id not in ARCHIVE_CHANNEL_IDS:
+        return None
+    return archive_post_key(chat.id, origin.message_id)
+
+def schedule_archive_flush():
+    if ARCHIVE_FLUSH["task"] is None:
+        ARCHIVE_FLUSH["task"] = asyncio.create_task(flush_archive_posts_later())
+
 async def on_channel_post(update: Update, context: ContextTypes.DEFAULT_TYPE):
     msg = update.channel_post
     if not msg:
         return
-    if msg.chat_id != ARCHIVE_CHANNEL_ID:
+    if not (msg.video or msg.document):
         return
-    if msg.video or msg.document:
-        log.info("Archive post received: message_id=%s", msg.message_id)
+    if msg.chat_id in ARCHIVE_CHANNEL_IDS:
+        log.info("Archive post received: chat_id=%s message_id=%s", msg.chat_id, msg.message_id)
+        ARCHIVE_PENDING[archive_post_key(msg.chat_id, msg.message_id)] = archive_post_entry(msg)
+        schedule_archive_flush()
+    elif msg.chat_id in ARCHIVE_MIRROR_IDS:
+        key = mirror_origin(msg)
+        if key:
+            log.info("Mirror post received: %s -> %s/%s", key, msg.chat_id, msg.message_id)
+            MIRROR_PENDING.setdefault(key, []).append([msg.chat_id, msg.message_id])
+            schedule_archive_flush()
+
+# ================= DIAGNOSTICS =================
+
+# /diag reports what this worker holds in memory: process size, live objects
+# by type, asyncio tasks by coroutine, user_data, in-memory state and rough
+# catalog/index sizes. With tracemalloc on it also lists the lines holding
+# the most memory and what grew since the previous report. DIAG_INTERVAL
+# appends the same report to DIAG_LOG_PATH periodically.
+
+DIAG = {"snapshot": None}
+
+diag_log = logging.getLogger("bot.diag")
+diag_log.propagate = False
+_diag_handler = logging.FileHandler(DIAG_LOG_PATH, encoding="utf-8", delay=True)
+_diag_handler.setFormatter(logging.Formatter("%(message)s"))
+diag_log.addHandler(_diag_handler)
+
+def deep_sizeof(obj, seen: set = None):
+    # Rough retained size of plain data (dicts, lists, sets, strings, numbers).
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(v, seen) for v in obj)
+    return size
+
+def estimate_sizeof(value):
+    # Large containers are measured on an even sample of their entries.
+    entries = list(value.items()) if isinstance(value, dict) else list(value)
+    if len(entries) <= DIAG_SAMPLE:
+        return deep_sizeof(value)
+    step = len(entries) / DIAG_SAMPLE
+    sampled = sum(deep_sizeof(entries[int(i * step)]) for i in range(DIAG_SAMPLE))
+    return sys.getsizeof(value) + int(sampled * len(entries) / DIAG_SAMPLE)
+
+def process_memory():
+    # Resident and peak resident size in bytes (Linux only).
+    sizes = {"rss": None, "peak": None}
+    try:
+        with open("/proc/self/status", encoding="utf-8") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if name in ("VmRSS", "VmHWM"):
+                    sizes["rss" if name == "VmRSS" else "peak"] = int(value.split()[0]) * 1024
+    except OSError:
+        pass
+    return sizes
+
+def object_counts():
+    counts = Counter(type(obj).__name__ for obj in gc.get_objects())
+    return {"total": sum(counts.values()), "top": counts.most_common(DIAG_TOP)}
+
+def task_counts():
+    counts = Counter()
+    for task in asyncio.all_tasks():
+        coro = task.get_coro()
+        counts[getattr(coro, "__qualname__", type(coro).__name__)] += 1
+    return {"total": sum(counts.values()), "top": counts.most_common(DIAG_TOP)}
+
+def user_data_report(app: Application):
+    # Like estimate_sizeof: past DIAG_SAMPLE users only an even sample is
+    # measured and the totals are scaled up; "largest" is from the sample.
+    users = [(user_id, data) for user_id, data in app.user_data.items() if data]
+    step = max(1, len(users) / DIAG_SAMPLE)
+    sample = [users[int(i * step)] for i in range(min(len(users), DIAG_SAMPLE))]
+    scale = len(users) / len(sample) if sample else 1
+    by_key = Counter()
+    by_user = []
+    for user_id, data in sample:
+        for key, value in data.items():
+            by_key[key] += deep_sizeof(value)
+        by_user.append((deep_sizeof(data), user_id))
+    return {
+        "users": len(app.user_data),
+        "non_empty": len(users),
+        "sampled": len(sample),
+        "bytes": int(sum(size for size, _ in by_user) * scale),
+        "keys": [(key, int(size * scale)) for key, size in by_key.most_common(DIAG_TOP)],
+        "largest": [[user_id, size] for size, user_id in heapq.nlargest(5, by_user)],
+        "chats": len(app.chat_data),
+    }
 
-# ================= MAIN =================
+def state_counts():
+    return {
+        "pending_deletes": len(PENDING_DELETES),
+        "delete_tasks": len(DELETE_TASKS),
+        "response_cache": len(RESPONSE_CACHE),
+        "outbound_queue": OUTBOUND["queue"].qsize() if OUTBOUND["queue"] else 0,
+        "watch_users": len(WATCH["data"] or {}),
+        "archive_pending": len(ARCHIVE_PENDING) + len(MIRROR_PENDING),
+        "deliveries": len(DELIVERIES["current"]) + len(DELIVERIES["previous"]),
+        "pinned": len(PINNED["files"]) + len(PINNED["overviews"]),
+        "update_log_buffer": len(RECORDER["buffer"]),
+        "scheduled": len(INDEX["schedule"]),
+    }
 
-def main():
+def catalog_report():
+    db = CATALOG["db"] or {}
+    memory = {key: estimate_sizeof(value) for key, value in db.items() if isinstance(value, (dict, list))}
+    index = {
+        key: estimate_sizeof(value)
+        for key, value in INDEX.items()
+        if isinstance(value, (dict, list, set)) and key != "keyboards"
+    }
+    try:
+        file_size = os.path.getsize(DB_PATH)
+    except OSError:
+        file_size = None
+    return {
+        "version": CATALOG["version"],
+        "items": len(db.get("items", {})),
+        "file": file_size,
+        "memory": memory,
+        "index": index,
+    }
+
+def trace_stat(stat):
+    frame = stat.traceback[0]
+    entry = {"at": f"{os.path.basename(frame.filename)}:{frame.lineno}", "bytes": stat.size, "count": stat.count}
+    if isinstance(stat, tracemalloc.StatisticDiff):
+        entry["diff"] = stat.size_diff
+    return entry
+
+def tracemalloc_report():
+    if not tracemalloc.is_tracing():
+        return None
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+    ))
+    current, peak = tracemalloc.get_traced_memory()
+    report = {
+        "traced": current,
+        "peak": peak,
+        "top": [trace_stat(stat) for stat in snapshot.statistics("lineno")[:DIAG_TOP]],
+    }
+    previous = DIAG["snapshot"]
+    if previous is not None:
+        growth = [stat for stat in snapshot.compare_to(previous, "lineno") if stat.size_diff > 0]
+        report["growth"] = [trace_stat(stat) for stat in growth[:DIAG_TOP]]
+    # Kept for the next diff; it holds one entry per traced line.
+    DIAG["snapshot"] = snapshot
+    return report
+
+async def diag_report(app: Application):
+    # The walks over every live object and the tracemalloc snapshots run in a
+    # worker thread. Sections reading live bot state stay on the loop (they
+    # are sampled) with a yield between them so updates keep flowing.
+    loop = asyncio.get_running_loop()
+    report = {"at": int(time.time()), "worker": WORKER_INDEX, "memory": process_memory()}
+    report["objects"] = await loop.run_in_executor(None, object_counts)
+    report["tasks"] = task_counts()
+    await asyncio.sleep(0)
+    report["user_data"] = user_data_report(app)
+    await asyncio.sleep(0)
+    report["state"] = state_counts()
+    report["catalog"] = catalog_report()
+    await asyncio.sleep(0)
+    report["tracemalloc"] = await loop.run_in_executor(None, tracemalloc_report)
+    return report
+
+def diag_text(report: dict):
+    def size(value):
+        return format_size(value) if value is not None else "?"
+
+    memory = report["memory"]
+    users = report["user_data"]
+    catalog = report["catalog"]
+    lines = [
+        "🧪 وضعیت حافظه" + (f" (worker {report['worker']})" if report["worker"] is not None else ""),
+        f"RSS: {size(memory['rss'])} | اوج: {size(memory['peak'])}",
+        f"\nاشیاء زنده: {report['objects']['total']}",
+        *(f"• {name}: {count}" for name, count in report["objects"]["top"]),
+        f"\nتسک‌ها: {report['tasks']['total']}",
+        *(f"• {name}: {count}" for name, count in report["tasks"]["top"]),
+        f"\nuser_data: {users['non_empty']} از {users['users']} کاربر، {size(users['bytes'])}"
+        + (f" (تخمین از {users['sampled']} نمونه)" if users["sampled"] < users["non_empty"] else ""),
+        *(f"• {key}: {size(value)}" for key, value in users["keys"]),
+        f"\nکاتالوگ: {catalog['items']} آیتم، فایل {size(catalog['file'])}، نسخه {catalog['version']}",
+        *(f"• {key}: {size(value)}" for key, value in sorted(catalog["memory"].items(), key=lambda x: -x[1])[:5]),
+        f"ایندکس‌ها: {size(sum(catalog['index'].values()))}",
+        *(f"• {key}: {size(value)}" for key, value in sorted(catalog["index"].items(), key=lambda x: -x[1])[:5]),
+        "\nحالت‌ها: " + "، ".join(f"{name} {count}" for name, count in report["state"].items()),
+    ]
+
+    traced = report["tracemalloc"]
+    if traced is None:
+        lines.append("\ntracemalloc خاموش است (/diag trace on)")
+    else:
+        lines.append(f"\ntracemalloc: {size(traced['traced'])} | اوج {size(traced['peak'])}")
+        lines += [f"• {s['at']}: {size(s['bytes'])} ({s['count']})" for s in traced["top"]]
+        if "growth" in traced:
+            lines.append("رشد از گزارش قبلی:")
+            lines += [f"• {s['at']}: +{size(s['diff'])}" for s in traced["growth"]] or ["• —"]
+    return "\n".join(lines)[:4000]
+
+async def diag_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin_update(update):
+        await update.message.reply_text("⛔ فقط ادمین می‌تواند استفاده کند")
+        return
+
+    args = context.args
+    if args[:1] == ["trace"]:
+        if args[1:2] == ["off"]:
+            tracemalloc.stop()
+            DIAG["snapshot"] = None
+            await update.message.reply_text("✅ tracemalloc خاموش شد")
+            return
+        frames = int(args[2]) if len(args) > 2 and args[2].isdigit() else 1
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        await update.message.reply_text("✅ tracemalloc روشن شد؛ گزارش بعدی رشد حافظه را هم نشان می‌دهد")
+        return
+
+    if args[:1] == ["gc"]:
+        collected = gc.collect()
+        await update.message.reply_text(f"♻️ {collected} شیء جمع‌آوری شد")
+
+    report = await diag_report(context.application)
+    await update.message.reply_text(diag_text(report))
+
+async def diag_loop(app: Application):
+    while True:
+        await asyncio.sleep(DIAG_INTERVAL)
+        diag_log.info(json.dumps(await diag_report(app), ensure_ascii=False))
+
+# ================= SHARDING =================
+
+# Set inside worker processes; None means the classic single-process bot.
+WORKER_INDEX = None
+
+def catalog_writer_shard(workers: int):
+    # Admin updates and archive channel posts all land on one worker, so it is
+    # the only process that ever writes the catalog.
+    return ADMIN_ID % workers
+
+def is_catalog_writer():
+    return WORKER_INDEX is None or WORKER_INDEX == catalog_writer_shard(WORKERS)
+
+def shard_for_update(update: Update, workers: int):
+    user = update.effective_user
+    if not user:
+        return catalog_writer_shard(workers)
+    return user.id % workers
+
+async def serve_shard(app: Application, queue, ready):
+    loop = asyncio.get_running_loop()
+    async with app:
+        await post_init(app)
+        await app.start()
+        if STARTUP["ready"]:
+            ready.set()
+        try:
+            while True:
+                data = await loop.run_in_executor(None, queue.get)
+                if data is None:
+                    break
+                await app.update_queue.put(Update.de_json(data, app.bot))
+        finally:
+            await app.stop()
+            await post_stop(app)
+            await post_shutdown(app)
+
+def run_worker(index: int, queue, ready):
+    global WORKER_INDEX
+    WORKER_INDEX = index
+    # The intake process owns shutdown and tells workers to stop via the queue.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    app = build_application(with_updater=False)
+    log.info("Worker %s started", index)
+    asyncio.run(serve_shard(app, queue, ready))
+    log.info("Worker %s stopped", index)
+
+async def intake_updates(queues, ready_events):
+    loop = asyncio.get_running_loop()
+    # Don't take updates off Telegram until every worker has warmed up.
+    for ready in ready_events:
+        await loop.run_in_executor(None, ready.wait)
+    log.info("All workers ready, polling")
+
+    bot = Bot(BOT_TOKEN, base_url=BOT_API_BASE_URL or "https://api.telegram.org/bot")
+    async with bot:
+        await bot.delete_webhook(drop_pending_updates=DROP_PENDING_UPDATES)
+        offset = None
+        while True:
+            try:
+                updates = await bot.get_updates(
+                    offset=offset,
+                    timeout=30,
+                    allowed_updates=Update.ALL_TYPES,
+                )
+            except TelegramError as e:
+                log.warning("getUpdates failed: %s", e)
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                record_update(update)
+                queues[shard_for_update(update, len(queues))].put(update.to_dict())
+                offset = update.update_id + 1
+
+def _raise_system_exit(*_):
+    raise SystemExit
+
+def run_sharded(workers: int):
+    ctx = multiprocessing.get_context("spawn")
+    queues = [ctx.Queue() for _ in range(workers)]
+    ready_events = [ctx.Event() for _ in range(workers)]
+    procs = [
+        ctx.Process(
+            target=run_worker,
+            args=(i, queues[i], ready_events[i]),
+            name=f"bot-worker-{i}",
+            daemon=True,
+        )
+        for i in range(workers)
+    ]
+    for p in procs:
+        p.start()
+
+    signal.signal(signal.SIGTERM, _raise_system_exit)
+    try:
+        asyncio.run(intake_updates(queues, ready_events))
+    except (KeyboardInterrupt, SystemExit):
+        log.info("Intake stopping")
+    finally:
+        flush_update_log()
+        for q in queues:
+            q.put(None)
+        # Workers drain their queue first; give them the drain budget plus slack.
+        deadline = time.monotonic() + DRAIN_TIMEOUT + 10
+        for p in procs:
+            p.join(max(0, deadline - time.monotonic()))
+            if p.is_alive():
+                log.warning("%s did not stop in time, terminating", p.name)
+                p.terminate()
+
+# ================= UPDATE LOG / REPLAY =================
+
+# Incoming updates are appended to UPDATE_LOG_PATH as gzip members of JSON
+# lines, {"at": unix time, "update": ...}, with names dropped and user ids
+# replaced by per-run pseudonyms (the admin keeps their id so admin flows
+# replay). `python main.py replay LOG...` feeds such logs back through the
+# real handlers against an in-process fake Bot API. Run it in a scratch
+# directory holding a copy of db.json: replayed admin actions write to it.
+RECORDER = {"path": UPDATE_LOG_PATH or None, "buffer": [], "flushed_at": 0.0, "salt": os.urandom(16)}
+REPLAY = {"enqueued": {}, "latencies": []}
+PRIVATE_FIELDS = {"last_name", "username", "language_code", "is_premium", "phone_number", "bio", "title"}
+
+def pseudonymize_user_id(user_id: int):
+    if user_id == ADMIN_ID:
+        return user_id
+    digest = hmac.new(RECORDER["salt"], str(user_id).encode(), hashlib.sha256).digest()
+    return 10**12 + int.from_bytes(digest[:5], "big")
+
+def sanitize_update(data):
+    if isinstance(data, list):
+        return [sanitize_update(value) for value in data]
+    if not isinstance(data, dict):
+        return data
+    clean = {key: sanitize_update(value) for key, value in data.items() if key not in PRIVATE_FIELDS}
+    if "first_name" in clean:
+        clean["first_name"] = "user"
+    # Users carry is_bot; private chats share the user's id.
+    if isinstance(clean.get("id"), int) and ("is_bot" in clean or clean.get("type") == "private"):
+        clean["id"] = pseudonymize_user_id(clean["id"])
+    return clean
+
+def record_update(update: Update):
+    if RECORDER["path"] is None:
+        return
+    RECORDER["buffer"].append(json.dumps({"at": time.time(), "update": sanitize_update(update.to_dict())}, ensure_ascii=False))
+    if len(RECORDER["buffer"]) >= UPDATE_LOG_BATCH or time.monotonic() - RECORDER["flushed_at"] >= UPDATE_LOG_FLUSH:
+        flush_update_log()
+
+def flush_update_log():
+    # One gzip member per batch; gzip readers concatenate them, and a crash
+    # loses at most the unflushed batch.
+    RECORDER["flushed_at"] = time.monotonic()
+    if not RECORDER["buffer"] or RECORDER["path"] is None:
+        return
+    data = gzip.compress(("\n".join(RECORDER["buffer"]) + "\n").encode("utf-8"))
+    RECORDER["buffer"].clear()
+    try:
+        with open(RECORDER["path"], "ab") as f:
+            f.write(data)
+    except OSError as e:
+        log.warning("Could not write update log: %s", e)
+
+def read_update_log(path: str):
+    records = []
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                if line.strip():
+                    records.append(json.loads(line))
+        except (EOFError, gzip.BadGzipFile, json.JSONDecodeError):
+            log.warning("%s: truncated after %s updates", path, len(records))
+    return records
+
+class ReplayRequest(BaseRequest):
+    # Stands in for the Bot API: every call takes `latency` seconds and
+    # answers with the smallest payload the handlers accept.
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = Counter()
+        self.message_ids = itertools.count(1)
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def message(self, params: dict):
+        try:
+            chat_id = int(params.get("chat_id") or 0)
+        except (TypeError, ValueError):
+            chat_id = 0
+        return {"message_id": next(self.message_ids), "date": int(time.time()), "chat": {"id": chat_id, "type": "private"}}
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        name = url.rsplit("/", 1)[-1]
+        self.calls[name] += 1
+        await asyncio.sleep(self.latency)
+        params = request_data.json_parameters if request_data else {}
+        if name == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "replay", "username": "replay_bot"}
+        elif name == "getChatMember":
+            result = {"status": "member", "user": {"id": int(params.get("user_id", 0)), "is_bot": False, "first_name": "u"}}
+        elif name == "copyMessage":
+            result = {"message_id": next(self.message_ids)}
+        elif name == "copyMessages":
+            result = [{"message_id": next(self.message_ids)} for _ in json.loads(params.get("message_ids", "[]"))]
+        elif name == "getFile":
+            result = {"file_id": params.get("file_id"), "file_unique_id": "f", "file_path": "f"}
+        elif name in ("sendPhoto", "editMessageMedia"):
+            result = self.message(params)
+            result["photo"] = [{"file_id": "p", "file_unique_id": "p", "width": 1, "height": 1}]
+        elif name.startswith(("send", "forward")) or (name.startswith("edit") and "inline_message_id" not in params):
+            result = self.message(params)
+        elif name == "getUpdates":
+            result = []
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+def percentile(sorted_values: list, fraction: float):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+async def replay(paths: list, speed: float):
+    records = sorted((r for path in paths for r in read_update_log(path)), key=lambda r: r["at"])
+    if not records:
+        raise SystemExit("No updates to replay")
+    RECORDER["path"] = None
+    random.seed(0)
+    request = ReplayRequest(REPLAY_API_LATENCY_MS / 1000)
+    app = build_application(with_updater=False, request=request)
+    loop = asyncio.get_running_loop()
+
+    async with app:
+        await post_init(app)
+        await app.start()
+        started = loop.time()
+        first = records[0]["at"]
+        try:
+            for record in records:
+                if speed > 0:
+                    await asyncio.sleep(max(0.0, started + (record["at"] - first) / speed - loop.time()))
+                update = Update.de_json(record["update"], app.bot)
+                REPLAY["enqueued"][id(update)] = time.perf_counter()
+                await app.update_queue.put(update)
+            await app.update_queue.join()
+            elapsed = loop.time() - started
+        finally:
+            await app.stop()
+            await post_stop(app)
+            await post_shutdown(app)
+
+    latencies = sorted(REPLAY["latencies"])
+    return {
+        "updates": len(records),
+        "processed": len(latencies),
+        "speed": speed,
+        "seconds": round(elapsed, 3),
+        "throughput": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "latency_ms": {
+            name: round(value * 1000, 1)
+            for name, value in (
+                ("p50", percentile(latencies, 0.5)),
+                ("p90", percentile(latencies, 0.9)),
+                ("p99", percentile(latencies, 0.99)),
+                ("max", latencies[-1] if latencies else 0.0),
+            )
+        },
+        "api_calls": dict(request.calls.most_common()),
+    }
+
+def replay_main(argv: list):
+    parser = argparse.ArgumentParser(prog="main.py replay", description="Replay recorded updates against a fake Bot API.")
+    parser.add_argument("logs", nargs="+", help="update logs written via UPDATE_LOG_PATH")
+    parser.add_argument("--speed", type=float, default=1.0, help="time scale: 1 = as recorded, 10 = ten times faster, 0 = no pauses")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
     if not BOT_TOKEN:
         raise RuntimeError("BOT_TOKEN تنظیم نشده")
-    if not ADMIN_ID:
-        raise RuntimeError("ADMIN_ID تنظیم نشده")
-    if not ARCHIVE_CHANNEL_ID:
-        raise RuntimeError("ARCHIVE_CHANNEL_ID تنظیم نشده")
 
-    app = Application.builder().token(BOT_TOKEN).build()
+    report = asyncio.run(replay(args.logs, args.speed))
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False))
+        return
+    latency = report["latency_ms"]
+    print(f"{report['processed']}/{report['updates']} updates in {report['seconds']}s at speed {report['speed']:g}: {report['throughput']} updates/s")
+    print(f"latency ms: p50 {latency['p50']}, p90 {latency['p90']}, p99 {latency['p99']}, max {latency['max']}")
+    print("api calls: " + ", ".join(f"{name} {count}" for name, count in report["api_calls"].items()))
+
+# ================= MAIN =================
+
+async def post_init(app: Application):
+    if DIAG_TRACEMALLOC and not tracemalloc.is_tracing():
+        tracemalloc.start(DIAG_TRACEMALLOC)
+    warm_up()
+    start_outbound()
+    resume_pending_deletes(app.bot)
+    BACKGROUND_TASKS.append(asyncio.create_task(broadcast_loop(app.bot)))
+    BACKGROUND_TASKS.append(asyncio.create_task(watch_flush_loop()))
+    BACKGROUND_TASKS.append(asyncio.create_task(overload_monitor()))
+    BACKGROUND_TASKS.append(asyncio.create_task(publish_loop()))
+    if DIAG_INTERVAL > 0:
+        BACKGROUND_TASKS.append(asyncio.create_task(diag_loop(app)))
+    if is_catalog_writer():
+        BACKGROUND_TASKS.append(asyncio.create_task(poster_check_loop(app.bot)))
+        BACKGROUND_TASKS.append(asyncio.create_task(audit_loop(app.bot)))
+    else:
+        BACKGROUND_TASKS.append(asyncio.create_task(catalog_watch_loop()))
+
+async def drain(app: Application):
+    # Runs after Application.stop(): intake is closed and queued/in-flight
+    # handlers have finished. Stop the background producers, let queued sends
+    # go out, then persist everything that only lives in memory.
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + DRAIN_TIMEOUT
+    started = time.perf_counter()
+
+    producers = [t for t in BACKGROUND_TASKS if t not in OUTBOUND["senders"]]
+    for task in producers:
+        task.cancel()
+    await asyncio.gather(*producers, return_exceptions=True)
+
+    queued = OUTBOUND["queue"].qsize() if OUTBOUND["queue"] else 0
+    left = await drain_outbound(deadline - loop.time())
+
+    if ARCHIVE_FLUSH["task"] is not None:
+        ARCHIVE_FLUSH["task"].cancel()
+    archived = flush_archive_posts()
+    try:
+        await flush_catalog()
+    except OSError as e:
+        log.error("Could not save the catalog: %s", e)
+    save_broadcast_state()
+    save_watch_history()
+    flush_update_log()
+    deletes = save_pending_deletes()
+
+    log.info(
+        "Drained in %.1fs: %s queued sends (%s dropped), %s archive posts flushed, %s deletes handed off",
+        time.perf_counter() - started, queued - left, left, archived, deletes,
+    )
+
+async def post_stop(app: Application):
+    await drain(app)
+
+async def post_shutdown(app: Application):
+    stop_outbound()
+    for task in BACKGROUND_TASKS:
+        task.cancel()
+    BACKGROUND_TASKS.clear()
+
+def build_application(with_updater: bool = True, request: BaseRequest = None):
+    builder = (
+        Application.builder()
+        .application_class(TracedApplication)
+        .token(BOT_TOKEN)
+        .update_queue(UpdateQueue())
+        .request(TracedRequest(request or HTTPXRequest(connection_pool_size=256)))
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+    )
+    if BOT_API_BASE_URL:
+        builder = builder.base_url(BOT_API_BASE_URL)
+    if not with_updater:
+        builder = builder.updater(None)
+    app = builder.build()
 
     add_conv = ConversationHandler(
         entry_points=[CommandHandler("add", add_start)],
@@ -1381,13 +5179,15 @@ def main():
     )
 
     edit_conv = ConversationHandler(
-        entry_points=[CommandHandler("edit", edit_command)],
+        entry_points=[
+            CommandHandler("edit", edit_command),
+            # Item buttons also work from /audit and from lists the conversation already left.
+            CallbackQueryHandler(edit_callback_entry, pattern=EDIT_CALLBACK_PATTERN),
+        ],
         states={
+            EDIT_BROWSE: [CallbackQueryHandler(edit_callback_entry, pattern=EDIT_CALLBACK_PATTERN)],
             EDIT_WAIT_TITLE: [
-                CallbackQueryHandler(
-                    edit_callback_entry,
-                    pattern=r"^(admin_edit_page:|edit_item:|edit_field:title:|edit_field:poster:|edit_field:moviefile:|edit_field:seriesfile:|edit_series_season:)"
-                ),
+                CallbackQueryHandler(edit_callback_entry, pattern=EDIT_CALLBACK_PATTERN),
                 MessageHandler(filters.TEXT & ~filters.COMMAND, edit_title_wait),
             ],
             EDIT_WAIT_POSTER: [
@@ -1416,18 +5216,58 @@ def main():
 
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("last", last))
+    app.add_handler(CommandHandler("new", new_command))
     app.add_handler(CommandHandler("search", search_command))
     app.add_handler(CommandHandler("delete", delete_command))
+    app.add_handler(CommandHandler("export", export_command))
+    app.add_handler(CommandHandler("subs", subs_command))
+    app.add_handler(CommandHandler("cat", category_command))
+    app.add_handler(CommandHandler("audit", audit_command))
+    app.add_handler(CommandHandler("schedule", schedule_command))
+    app.add_handler(CommandHandler("diag", diag_command))
+
+    import_conv = ConversationHandler(
+        entry_points=[CommandHandler("import", import_start)],
+        states={
+            IMPORT_WAIT_FILE: [
+                MessageHandler(filters.ALL & ~filters.COMMAND & ~filters.StatusUpdate.ALL, import_file)
+            ],
+        },
+        fallbacks=[CommandHandler("cancel", cancel)],
+        per_chat=True,
+        per_user=True,
+        per_message=False,
+    )
 
     app.add_handler(add_conv)
     app.add_handler(edit_conv)
+    app.add_handler(import_conv)
 
     app.add_handler(CallbackQueryHandler(on_callback))
+    app.add_handler(InlineQueryHandler(on_inline_query))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, on_text))
     app.add_handler(MessageHandler(filters.UpdateType.CHANNEL_POST, on_channel_post))
+    return app
+
+def main():
+    if sys.argv[1:2] == ["replay"]:
+        replay_main(sys.argv[2:])
+        return
+    if not BOT_TOKEN:
+        raise RuntimeError("BOT_TOKEN تنظیم نشده")
+    if not ADMIN_ID:
+        raise RuntimeError("ADMIN_ID تنظیم نشده")
+    if not ARCHIVE_CHANNEL_ID:
+        raise RuntimeError("ARCHIVE_CHANNEL_ID تنظیم نشده")
+
+    if WORKERS > 1:
+        log.info("BOT RUNNING with %s workers", WORKERS)
+        run_sharded(WORKERS)
+        return
 
+    app = build_application()
     log.info("BOT RUNNING")
-    app.run_polling(drop_pending_updates=True)
+    app.run_polling(drop_pending_updates=DROP_PENDING_UPDATES)
 
 if __name__ == "__main__":
     main()